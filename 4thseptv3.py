@@ -1,263 +1,177 @@
 
 import streamlit as st
 import pandas as pd
-import numpy as np
-import zipfile
 import os
-import tempfile
+import zipfile
 import base64
-import io
-import xlsxwriter
-from fpdf import FPDF
-import streamlit_pdf_viewer as pdf_viewer
-from streamlit_folium import st_folium
-import folium
-import plotly.express as px
-import streamlit.components.v1 as components
-
-# Define the parameter descriptions
-parameter_descriptions = {
-    'A1': "School + Grade + Student",
-    'A2': "Block + School + Grade + Student",
-    'A3': "District + School + Grade + Student",
-    'A4': "Partner + School + Grade + Student",
-    'A5': "District + Block + School + Grade + Student",
-    'A6': "Partner + Block + School + Grade + Student",
-    'A7': "Partner + District + School + Grade + Student",
-    'A8': "Partner + District + Block + School + Grade + Student"
-}
-
-# Define the new mapping for parameter sets
-parameter_mapping = {
-    'A1': "School_ID,Grade,student_no",
-    'A2': "Block_ID,School_ID,Grade,student_no",
-    'A3': "District_ID,School_ID,Grade,student_no",
-    'A4': "Partner_ID,School_ID,Grade,student_no",
-    'A5': "District_ID,Block_ID,School_ID,Grade,student_no",
-    'A6': "Partner_ID,Block_ID,School_ID,Grade,student_no",
-    'A7': "Partner_ID,District_ID,School_ID,Grade,student_no",
-    'A8': "Partner_ID,District_ID,Block_ID,School_ID,Grade,student_no"
-}
-
-# Dropdown for selecting file naming format
-naming_options = {
-    "School Name + District Name": "{school_name}_{district_name}",
-    "School Name + Block Name": "{school_name}_{block_name}",
-    "School Name + Grade": "{school_name}_Grade{grade}"
-}
-
-def generate_custom_id(row, params):
-    params_split = params.split(',')
-    custom_id = []
-    for param in params_split:
-        if param in row and pd.notna(row[param]):
-            value = row[param]
-            if isinstance(value, float) and value % 1 == 0:
-                value = int(value)
-            custom_id.append(str(value))
-    return ''.join(custom_id)
-
-def process_data(uploaded_file, partner_id, buffer_percent, grade, district_digits, block_digits, school_digits, student_digits, selected_param):
-    data = pd.read_excel(uploaded_file)
-    # Assign the Partner_ID directly
-    data['Partner_ID'] = str(partner_id).zfill(len(str(partner_id)))  # Padding Partner_ID
-    data['Grade'] = grade
-    # Assign unique IDs for District, Block, and School, default to "00" for missing values
-    data['District_ID'] = data['District'].apply(lambda x: str(data['District'].unique().tolist().index(x) + 1).zfill(district_digits) if x != "NA" else "0".zfill(district_digits))
-    data['Block_ID'] = data['Block'].apply(lambda x: str(data['Block'].unique().tolist().index(x) + 1).zfill(block_digits) if x != "NA" else "0".zfill(block_digits))
-    data['School_ID'] = data['School_ID'].apply(lambda x: str(data['School_ID'].unique().tolist().index(x) + 1).zfill(school_digits) if x != "NA" else "0".zfill(school_digits))
-    # Calculate Total Students With Buffer based on the provided buffer percentage
-    data['Total_Students_With_Buffer'] = np.floor(data['Total_Students'] * (1 + buffer_percent / 100))
-    # Generate student IDs based on the calculated Total Students With Buffer
-    def generate_student_ids(row):
-        if pd.notna(row['Total_Students_With_Buffer']) and row['Total_Students_With_Buffer'] > 0:
-            student_ids = [
-                f"{row['School_ID']}{str(int(row['Grade'])).zfill(2)}{str(i).zfill(student_digits)}"
-                for i in range(1, int(row['Total_Students_With_Buffer']) + 1)
-            ]
-            return student_ids
-        return []
-    data['Student_IDs'] = data.apply(generate_student_ids, axis=1)
-    # Expand the data frame to have one row per student ID
-    data_expanded = data.explode('Student_IDs')
-    # Extract student number from the ID
-    data_expanded['student_no'] = data_expanded['Student_IDs'].str[-student_digits:]
-    # Use the selected parameter set for generating Custom_ID
-    data_expanded['Custom_ID'] = data_expanded.apply(lambda row: generate_custom_id(row, parameter_mapping[selected_param]), axis=1)
-    # Generate the additional Excel sheets with mapped columns (without the Gender column)
-    data_mapped = data_expanded[['Custom_ID', 'Grade', 'School', 'School_ID', 'District', 'Block']].copy()
-    data_mapped.columns = ['Roll_Number', 'Grade', 'School Name', 'School Code', 'District Name', 'Block Name']
-    # Generate Teacher_Codes sheet
-    teacher_codes = data[['School', 'School_ID']].copy()
-    teacher_codes.columns = ['School Name', 'School Code']
-    return data_expanded, data_mapped, teacher_codes
-
-def download_link(df, filename, link_text):
-    towrite = io.BytesIO()
-    with pd.ExcelWriter(towrite, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Sheet1')
-    towrite.seek(0)
-    b64 = base64.b64encode(towrite.read()).decode()
-    return f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}" class="download-link"><img src="https://img.icons8.com/material-outlined/24/000000/download.png" class="download-icon"/> {link_text}</a>'
-
-# Function to create the attendance list PDF
-def create_attendance_pdf(pdf, column_widths, column_names, image_path, info_values, df):
-    pdf.add_page()
-
-    # Set top margin to 25 mm
-    pdf.set_top_margin(20)
-    pdf.set_auto_page_break(auto=True, margin=20)
-
-    # Page width and margins
-    page_width = 210  # A4 page width in mm
-    margin_left = 10
-    margin_right = 10
-    available_width = page_width - margin_left - margin_right
-
-    # Calculate total column width
-    total_column_width = sum(column_widths[col] for col in column_names)
-
-    # Scale column widths if necessary
-    if total_column_width > available_width:
-        scaling_factor = available_width / total_column_width
-        column_widths = {col: width * scaling_factor for col, width in column_widths.items()}
-
-    # Move to 20 mm from the top
-    pdf.set_y(20)
-
-    # Set the Font for the Title and Subtitle
-    pdf.set_font('Arial', 'B', 7)
-
-    # Calculate the Width of the Merged Cell
-    merged_cell_width = sum(column_widths[col] for col in column_names)  # Total width based on scaled column widths
-
-    # Add the Title and Subtitle in the Center
-    pdf.cell(merged_cell_width, 12, '', border='LTR', ln=1, align='C')  # Create an empty cell with borders
-
-    # Set the cursor position back to the beginning of the merged cell
-    pdf.set_xy(pdf.get_x(), pdf.get_y() - 10)
-
-    # Centered Title
-    pdf.cell(merged_cell_width, 4, 'ATTENDANCE LIST', border=0, align='C', ln=2)
-
-    # Centered Subtitle
-    pdf.set_font('Arial', '', 3)
-    pdf.cell(merged_cell_width, 1, '(PLEASE FILL ALL THE DETAILS IN BLOCK LETTERS)', border=0, align='C', ln=1)
-
-    # Bottom border of the merged cell
-    pdf.cell(merged_cell_width, 3, '', border='LBR', ln=1)  # Bottom border of the merged cell
-
-    # Add the image in the top-right corner of the bordered cell
-    pdf.image(image_path, x=pdf.get_x() + 153, y=pdf.get_y() - 8, w=15, h=5)  # Adjust position and size as needed
-
-    # Add the additional information cell below the "ATTENDANCE LIST" cell
-    pdf.set_font('Arial', 'B', 5)
-    info_cell_width = merged_cell_width  # Width same as the merged title cell
-    info_cell_height = 15  # Adjust height as needed
-    pdf.cell(info_cell_width, info_cell_height, '', border='LBR', ln=1)
-    pdf.set_xy(pdf.get_x(), pdf.get_y() - info_cell_height)  # Move back to the top of the cell
-
-    # Add labels and fill values from the dictionary
-    info_labels = {
-        'DISTRICT': '',
-        'BLOCK': '',
-        'SCHOOL NAME': '',
-        'CLASS': '',
-        'SECTION': ''
+from pipeline import (parameter_descriptions, naming_options, bundle_options, process_data,
+                      render_pdfs, render_bundles, package_zip, IdCapacityError, find_schools, render_school_pdf)
+from id_registry import default_registry
+from instrumentation import StageRecorder, recording
+from jobs import job_manager
+from pdf_assets import logo_for_partner
+from result_cache import pdf_cache, result_cache, roster_hash
+from result_store import result_store
+from roster_io import export_formats, export_frame
+
+# Shared ID registry when ATTENDANCE_ID_REGISTRY names one, so re-uploads keep the IDs already handed out
+id_registry = default_registry()
+
+def load_generated(run_key, uploaded_file):
+    # Open this session's run from the shared result store (memory-mapped, nothing is copied per session); after
+    # eviction it is regenerated from the roster if the same file is still uploaded, otherwise None is returned
+    generated = result_store.get(run_key)
+    if generated is None and uploaded_file is not None and roster_hash(uploaded_file) == run_key[0]:
+        generated = result_store.get_or_compute(run_key, lambda: process_data(uploaded_file, *run_key[1:], registry=id_registry))
+    return generated
+
+def performance_recorder():
+    # Stage recorder for this run when the performance panel is enabled, otherwise None (no instrumentation)
+    return StageRecorder() if st.session_state.get('show_performance') else None
+
+def show_performance(records, title="Performance"):
+    # Per-stage wall/CPU time, rows and peak memory of the last run
+    if not st.session_state.get('show_performance'):
+        return
+    with st.expander(title, expanded=True):
+        if not records:
+            st.caption("Served from the result cache; no stages ran.")
+            return
+        # peak_rss_bytes: records of jobs finished before the per-stage memory change was recorded
+        table = pd.DataFrame(records).drop(columns=['peak_rss_bytes'], errors='ignore')
+        for column in ('rss_change_bytes', 'process_peak_rss_bytes'):
+            if column in table:
+                table[column.replace('_bytes', '_mb')] = (pd.to_numeric(table.pop(column)) / (1024 * 1024)).round(1)
+        st.dataframe(table, hide_index=True)
+        st.caption(f"Total: {table['seconds'].sum():.3f}s wall, {table['cpu_seconds'].sum():.3f}s CPU. "
+                   "rss_change_mb is how much this server process' memory grew during the stage (other sessions running at "
+                   "the same time count too); process_peak_rss_mb is the server process' high-water mark, not the stage's.")
+
+def generate_ids_job(job, uploaded_file, run_key, recorder):
+    # Background job: read the roster and assign the IDs into the shared result store
+    load_report = {}
+    with recording(recorder):
+        result_store.get_or_compute(run_key, lambda: process_data(uploaded_file, *run_key[1:], report=load_report, registry=id_registry))
+    if load_report:
+        result_cache.put(run_key + ('load',), load_report)
+    return {'performance': recorder.records if recorder else []}
+
+def render_zip_job(job, run_key, filename_template, logo, workers, recorder, bundle=None):
+    # Background job: render every school's sheet of a stored run into attendance_Sheets.zip in the job directory,
+    # building each school's student IDs only when its sheet is rendered; bundle ('district' or 'block') writes one
+    # bookmarked PDF per district or block instead
+    table = result_store.get(run_key)
+    if table is None:
+        raise ValueError("The generated IDs have expired. Please click Generate IDs again.")
+    with recording(recorder):
+        result = table.school_records()
+        job.check_cancelled()
+        if bundle is None:
+            rendered = render_pdfs(result, None, filename_template, logo, workers=workers, progress=job.progress, student_ids=table.student_ids)
+        else:
+            rendered = render_bundles(result, None, filename_template, bundle, logo, workers=workers, progress=job.progress, student_ids=table.student_ids)
+        zip_archive, pdf_names, failures = package_zip(rendered, job.artifact_path('attendance_Sheets.zip'))
+    zip_archive.close()
+    return {
+        'zip': 'attendance_Sheets.zip',
+        'first_pdf': pdf_names[0] if pdf_names else None,
+        'failures': failures,
+        'performance': recorder.records if recorder else []
     }
 
-    for label in info_labels.keys():
-        for key, value in info_values.items():
-            if label[:5].lower() == key[:5].lower():  # Match first 5 characters, ignoring case
-                info_labels[label] = value
-                break
-
-    # Width for the school name and date of assessment cells
-    school_name_width = info_cell_width * 0.65  # 65% of the total width for the school name
-    date_width = info_cell_width * 0.35         # 35% of the total width for the date of assessment
-
-    # Add the DISTRICT, BLOCK, and other labels
-    pdf.cell(info_cell_width, 3, f"DISTRICT : {info_labels['DISTRICT']}", border='LR', ln=1)
-    pdf.cell(info_cell_width, 3, f"BLOCK : {info_labels['BLOCK']}", border='LR', ln=1)
-
-    # Add the SCHOOL NAME
-    pdf.cell(school_name_width, 3, f"SCHOOL NAME : {info_labels['SCHOOL NAME']}", border='L', ln=0)  # Left border only
-
-    # Set a different font for the DATE OF ASSESSMENT
-    pdf.set_font('Arial', 'B', 4)  # Set to Arial, Italic, size 5
-
-    # Add the DATE OF ASSESSMENT on the right side
-    pdf.cell(date_width, 3, "DATE OF ASSESSMENT : ______________            ", border='R', ln=1, align='R')  # Right border only
-
-    # Reset the font back to the original for the remaining labels
-    pdf.set_font('Arial', 'B', 5)
-
-    # Add the CLASS and SECTION labels
-    pdf.cell(info_cell_width, 3, f"CLASS : {info_labels['CLASS']}", border='LR', ln=1)
-    pdf.cell(info_cell_width, 3, f"SECTION : {info_labels['SECTION']}", border='LR', ln=1)
-
-    # Draw a border around the table header
-    pdf.set_font('Arial', 'B', 5)
-    table_cell_height = 9
-
-    # Add the Title and Subtitle in the Center
-
-    pdf.cell(6, 4,'', border='LTR', align='C')
-    pdf.cell(15,4,'', border='LTR', align='C')
-    pdf.cell(60,4, '', border='LTR', align='C')
-    pdf.cell(10,4, '', border='LTR', align='C')
-    pdf.cell(10,4, '', border='LTR', align='C')
-    pdf.cell(23,4, '', border='LTR', align='C')
-    pdf.cell(24,4, '', border='LTR', align='C')
-    pdf.cell(24,4, '', border='LTR', align='C')  # End of the row
-
-    pdf.ln(4)
-    # First row of headers
-    pdf.cell(6, 0.5, 'S.NO', border='LR', align='C')
-    pdf.cell(15,0.5, 'STUDENT ID', border='LR', align='C')
-    pdf.cell(60,0.5, 'STUDENT NAME', border='LR', align='C')
-    pdf.cell(10,0.5, 'GENDER', border='LR', align='C')
-    pdf.cell(10,0.5, 'TAB ID', border='LR', align='C')
-    pdf.cell(23,0.5, 'SESSION', border='LR', align='C')
-    pdf.cell(24,0.5, 'SUBJECT 1', border='LR', align='C')
-    pdf.cell(24,0.5, 'SUBJECT 2', border='LR', align='C')  # End of the row
-
-    # Move to the next line
-    pdf.ln(0.5)
-
-    # Second row of headers (merged cells)
-    pdf.set_font("Arial", size=5)
-    pdf.cell(6, 4.5, '', border='LBR', align='C')  # Empty cell under S.NO
-    pdf.cell(15, 4.5, '', border='LBR', align='C')  # Empty cell under STUDENT ID
-    pdf.cell(60, 4.5, '', border='LBR', align='C')  # Empty cell under STUDENT NAME
-    pdf.cell(10, 4.5, '', border='LBR', align='C')  # Empty cell under GENDER
-    pdf.cell(10, 4.5, '', border='LBR', align='C')  # Empty cell under TAB ID
-    pdf.cell(23, 4.5, '(morning/afternoon)', border='LBR', align='C')  # SESSION description
-    pdf.cell(24, 4.5, 'Present/Absent', border='LBR', align='C')  # SUBJECT 1 details
-    pdf.cell(24, 4.5, 'Present/Absent', border='LBR', align='C')  # SUBJECT 2 details
-
-    pdf.ln(4.5)
-
-    # Table Rows (based on student_count)
-    pdf.set_font('Arial', '', 6)
-    student_count = info_values.get('student_count', 0)  # Use 0 if 'student_count' is missing or not found
-
-    # Fill in the student IDs for the selected school code
-    student_ids = df[df['School Code'] == info_values.get('School Code', '')]['STUDENT ID'].tolist()
-
-    for i in range(student_count):
-        # Fill in S.NO column
-        pdf.cell(column_widths['S.NO'], table_cell_height, str(i + 1), border=1, align='C')
-
-        # Fill in STUDENT ID column
-        student_id = student_ids[i]
-        pdf.cell(column_widths['STUDENT ID'], table_cell_height, str(student_id), border=1, align='C')
-
-        # Fill in remaining columns with empty values
-        for col_name in column_names[2:]:  # Skip first two columns
-            pdf.cell(column_widths[col_name], table_cell_height, '', border=1, align='C')
-
-        pdf.ln(table_cell_height)
+def school_label(record):
+    return f"{record.get('School Name')} ({record.get('School Code')}, {record.get('District Name')}) - Grade {record.get('CLASS')}"
+
+def show_school_reprint(run_key, table, naming):
+    # Look up one school by name or code and render just its sheet. Sheets are cached per roster and ID settings
+    # (run_key), school and naming format, so reprinting the same school again is served from memory.
+    query = st.text_input("Reprint one school: enter a school name or code", key='school_query')
+    if not query:
+        return
+    records = result_cache.get_or_compute(run_key + ('school_records',), table.school_records)
+    matches = find_schools(records, query)
+    if not matches:
+        st.warning(f"No school code or name matches \"{query}\".")
+        return
+    choice = st.selectbox("School", range(len(matches)), format_func=lambda index: school_label(matches[index])) if len(matches) > 1 else 0
+    record = matches[choice]
+    school_key = tuple(str(record.get(column)) for column in ('CLASS', 'School Name', 'School Code', 'District Name', 'Block Name'))
+    logo = logo_for_partner(st.session_state.get('partner_id', 1))
+    try:
+        file_name, pdf_data = pdf_cache.get_or_compute(
+            run_key + ('school_pdf', naming) + school_key,
+            lambda: render_school_pdf(record, naming_options[naming], logo, student_ids=table.student_ids)
+        )
+    except ValueError as e:
+        st.error(str(e))
+        return
+    st.download_button(f"Download {file_name}", pdf_data, file_name=file_name, mime="application/pdf")
+
+@st.fragment(run_every=1.0)
+def pdf_job_progress(job_id):
+    # Polls the running job once a second without rerunning the whole page; reruns the page once the job ends
+    job = job_manager.get(job_id)
+    if job is None or job['status'] not in ('queued', 'running'):
+        st.rerun()
+    if job['status'] == 'queued':
+        st.info(f"Waiting for a free slot on the server ({job_manager.queue_position(job_id)} job(s) ahead)...")
+    else:
+        st.progress(job['done'] / job['total'] if job['total'] else 0.0, text=f"Rendered {job['done']}/{job['total']} PDFs")
+    st.caption(f"Job {job_id}: you can leave this page open or come back later with the same link.")
+    if st.button("Cancel", key=f'cancel_{job_id}'):
+        job_manager.cancel(job_id)
+
+def show_pdf_job(job_id):
+    # Progress of a PDF job while it runs, then its preview link and zip download
+    job = job_manager.get(job_id)
+    if job is None:
+        st.warning("These attendance sheets are no longer available. Please generate them again.")
+        return
+    if job['status'] in ('queued', 'running'):
+        pdf_job_progress(job_id)
+        return
+    if job['status'] == 'cancelled':
+        st.info("PDF generation was cancelled.")
+        return
+    if job['status'] == 'failed':
+        st.error(f"PDF generation failed: {job['error']}")
+        return
+    result = job['result']
+    show_performance(result.get('performance') or [], "PDF Performance")
+
+    # Schools that could not be rendered are reported but do not stop the rest of the batch
+    failures = result.get('failures') or []
+    if failures:
+        st.warning(f"{len(failures)} PDF(s) could not be generated:\n\n" + "\n".join(f"- {file_name}: {error}" for file_name, error in failures))
+
+    # Custom smaller header for PDF Preview
+    st.markdown(
+        """
+        <h3 style='text-align: left; font-size:24px; color:#4CAF50;'>PDF Preview</h3>
+        """, 
+        unsafe_allow_html=True
+    )
+    zip_path = job_manager.artifact_path(job_id, result['zip'])
+    if result.get('first_pdf'):
+        # Read the first PDF back from the archive for preview
+        with zipfile.ZipFile(zip_path) as zip_file:
+            pdf_data = zip_file.read(result['first_pdf'])
+        base64_pdf = base64.b64encode(pdf_data).decode('utf-8')
+        # Create a download link for the PDF
+        pdf_link = f'<a href="data:application/pdf;base64,{base64_pdf}" download="{os.path.basename(result["first_pdf"])}">Click here to download and view PDF</a>'
+        
+        # Display the link in Streamlit
+        st.markdown(pdf_link, unsafe_allow_html=True)
+
+    # Provide download link for the zip file
+    with open(zip_path, 'rb') as zip_archive:
+        st.download_button(
+            label="Click to Download Zip File",
+            data=zip_archive.read(),
+            file_name="attendance_Sheets.zip",
+            mime="application/zip"
+        )
+    st.session_state['thank_you_displayed'] = True  # Set the thank you message state
 
 def main():
     
@@ -265,7 +179,7 @@ def main():
     if 'buttons_initialized' not in st.session_state:
         st.session_state['buttons_initialized'] = True
         st.session_state['generate_clicked'] = False
-        st.session_state['download_data'] = None
+        st.session_state['run_key'] = None
         st.session_state['checkboxes_checked'] = False
         st.session_state['thank_you_displayed'] = False  # Initialize thank you state
 
@@ -376,12 +290,13 @@ def main():
         **Note:**
         
         - School_ID column should be unique
-        - Please upload an XLSX file that is less than 200MB in size.
+        - An optional Grade column (e.g. 5, 1,2,3 or 1-12) generates every listed grade in one pass, with one folder per grade in the zip
+        - Please upload an XLSX, CSV or Parquet file that is less than 200MB in size.
         """
     )
     
     # File uploader section
-    uploaded_file = st.file_uploader("Upload an Excel file", type=["xlsx"])
+    uploaded_file = st.file_uploader("Upload an Excel, CSV or Parquet file", type=["xlsx", "csv", "parquet"])
     if uploaded_file is not None:
         # Centered and colored message
         st.markdown("<p style='text-align: center; color: green;'>File uploaded successfully!</p>", unsafe_allow_html=True)
@@ -401,7 +316,7 @@ def main():
         if run_default:
             # Default parameters
             partner_id = 1
-            grade = st.number_input("Grade", min_value=1, value=1)
+            grade = st.number_input("Grade", min_value=1, value=1, help="Used for schools without a value in the roster's Grade column")
             buffer_percent = 0.0
             district_digits = 2
             block_digits = 2
@@ -413,7 +328,7 @@ def main():
             st.markdown("<p style='color: blue;'>Please provide required Values</p>", unsafe_allow_html=True)
             partner_id = st.number_input("Partner ID", min_value=1, value=1)
             buffer_percent = st.number_input("Buffer Percentage", min_value=0.0, value=0.0, format="%.2f")
-            grade = st.number_input("Grade", min_value=1, value=1)
+            grade = st.number_input("Grade", min_value=1, value=1, help="Used for schools without a value in the roster's Grade column")
             
             # Message in blue color above District ID Digits
             st.markdown("<p style='color: blue;'>Please provide required Digits</p>", unsafe_allow_html=True)
@@ -444,12 +359,12 @@ def main():
             # Create the format string based on selected_param
             param_description = parameter_descriptions[selected_param]
             format_parts = param_description.split(' + ')
-            format_string = ' '.join([f"{'X' * (school_digits if 'School' in part else 
-            block_digits if 'Block' in part else 
-            district_digits if 'District' in part else 
-            len(str(grade)) if 'Grade' in part else 
-            len(str(partner_id)) if 'Partner' in part else 
-            student_digits)}" for part in format_parts])
+            format_string = ' '.join(['X' * (school_digits if 'School' in part else
+            block_digits if 'Block' in part else
+            district_digits if 'District' in part else
+            len(str(grade)) if 'Grade' in part else
+            len(str(partner_id)) if 'Partner' in part else
+            student_digits) for part in format_parts])
             
             # Display the ID format with a smaller font size
             st.markdown(f"<p style='font-size: small;'>Your ID format would be: {format_string}</p>", unsafe_allow_html=True)
@@ -461,18 +376,19 @@ def main():
 
             
             # Warning box in yellow color
-            st.error( """Note: Avoid Digit Overload in your Enrolments"""
+            st.error( """Note: Avoid Digit Overload in your Enrolments. Settings whose digits cannot hold the roster, or that would give two students the same ID, are rejected before generation."""
             )
 
         
         # Generate button action
         if st.session_state['checkboxes_checked']:
+            st.checkbox("Show Performance Panel", key='show_performance')
             if st.button("Generate IDs"):
                 if uploaded_file is not None:
                     try:
-                        # Process the uploaded file
-                        expanded_data, mapped_data, teacher_codes = process_data(
-                            uploaded_file,
+                        # Process the uploaded file; identical roster content and settings reuse the shared cached result
+                        run_key = (
+                            roster_hash(uploaded_file),
                             partner_id,
                             buffer_percent,
                             grade,
@@ -482,49 +398,38 @@ def main():
                             student_digits,
                             selected_param
                         )
-                        # Update session state with generated data
-                        st.session_state['download_data'] = (expanded_data, mapped_data, teacher_codes)
-                        st.session_state['generate_clicked'] = True
+                        # IDs run in the job manager's quick lane, apart from the PDF renders, so the page can wait for them
+                        job_id = job_manager.submit('ids', generate_ids_job, uploaded_file, run_key, performance_recorder())
+                        with st.spinner("Generating IDs..."):
+                            job = job_manager.wait(job_id)
+                        if job['status'] == 'done':
+                            st.session_state['performance'] = job['result']['performance']
+                            # Only the cache key is kept per session; the frames live in the shared cache
+                            st.session_state['run_key'] = run_key
+                            st.session_state['partner_id'] = partner_id
+                            st.session_state['generate_clicked'] = True
+                            # Sheets of an earlier run no longer match these IDs
+                            st.session_state.pop('pdf_job', None)
+                            st.query_params.pop('job', None)
+                        elif job['error_type'] == IdCapacityError.__name__:
+                            # Rejected before any expansion or rendering; the report names each level or school that does not fit
+                            st.error(job['error'])
+                        else:
+                            st.error(f"Error processing file: {job['error']}")
                     except Exception as e:
                         st.error(f"Error processing file: {e}")
 
     # Download buttons after IDs are generated
-    if st.session_state['generate_clicked'] and st.session_state['download_data'] is not None:
-        expanded_data, mapped_data, teacher_codes = st.session_state['download_data']
-
-        df1 = mapped_data
-        # Define possible variations of 'Student ID' column names
-        student_id_variations = ['STUDENT ID', 'STUDENT_ID', 'ROLL_NUMBER', 'Roll_Number', 'Roll Number']
-        # Identify the actual column name from the variations
-        student_id_column = None
-        for variation in student_id_variations:
-            if variation in df1.columns:
-                student_id_column = variation
-                break
-
-        if student_id_column is None:
-            raise ValueError("No recognized student ID column found in the data")
-
-        class_variations = ['CLASS', 'Class', 'GRADE', 'Grade']
-        # Identify the actual column name from the variations
-        class_column = None
-        for variation in class_variations:
-            if variation in df1.columns:
-                class_column = variation
-                break
-        if class_column is None:
-            raise ValueError("No recognized student ID column found in the data")
-
-        # Standardize column name to 'STUDENT_ID'
-        df = df1.rename(columns={student_id_column: 'STUDENT ID', class_column: 'CLASS'})
-        # Process data
-        grouping_columns = [col for col in df.columns if col not in ['STUDENT ID', 'Gender'] and df[col].notna().any()]
-        grouped = df.groupby(grouping_columns).agg(student_count=('STUDENT ID', 'nunique')).reset_index()
-
-        if 'CLASS' in grouped.columns and grouped['CLASS'].astype(str).str.contains('\D').any():
-            grouped['CLASS'] = grouped['CLASS'].astype(str).str.extract('(\d+)')
-
-        result = grouped.to_dict(orient='records')
+    if st.session_state['generate_clicked'] and st.session_state['run_key'] is not None:
+        run_key = st.session_state['run_key']
+        generated = load_generated(run_key, uploaded_file)
+        if generated is None:
+            st.warning("Your generated IDs have expired. Please click Generate IDs again.")
+            return
+        table = generated
+
+        # KPIs come straight from the school rows; nothing per student is built until a download or the PDFs are requested
+        kpis = table.kpis()
 
         # KPI Cards
         css = """
@@ -551,29 +456,40 @@ def main():
         # Display the styled subheader
         st.markdown("<div class='custom-subheader'>Your Summary</div>", unsafe_allow_html=True)
 
-        # Calculating KPIs
-        num_students = len(df['STUDENT ID'].unique())
-        num_schools = df['School Name'].nunique() if 'School Name' in df.columns else 0
-        num_blocks = df['Block Name'].nunique() if 'Block Name' in df.columns else 0
-        num_districts = df['District Name'].nunique() if 'District Name' in df.columns else 0
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.metric("Number of Students", num_students)
-        with col2:
-            st.metric("Number of Schools", num_schools)
-        with col3:
-            st.metric("Number of Blocks", num_blocks)
-        with col4:
-            st.metric("Number of Districts", num_districts)
+        # Report how the roster was loaded
+        load_report = result_cache.get(run_key + ('load',))
+        if load_report:
+            st.caption(f"Loaded {load_report['rows']} roster rows from {load_report['format'].upper()} ({load_report['engine']} reader) in {load_report['seconds']:.2f}s")
+
+        # Display one metric card per KPI
+        kpi_columns = st.columns(len(kpis))
+        for kpi_column, (label, value) in zip(kpi_columns, kpis.items()):
+            with kpi_column:
+                st.metric(label, value)
+        show_performance(st.session_state.get('performance'))
         
+        # Export format of the downloads; large xlsx exports continue on extra sheets past Excel's row limit
+        export_format = st.selectbox("Download format", list(export_formats), format_func=str.upper)
+        extension, mime = export_formats[export_format]
+
         # Download button for full data with Custom_IDs and Student_IDs
-        #st.markdown(download_link(expanded_data, "full_data.xlsx", "Download Full Data (with Custom_IDs and Student_IDs)"), unsafe_allow_html=True)
+        #st.download_button("Download Full Data (with Custom_IDs and Student_IDs)", export_frame(table.expanded_frame(), export_format), f"full_data{extension}", mime)
         
         # Download button for mapped data
-        st.markdown(download_link(mapped_data, "Student_Ids.xlsx", "Download Student IDs"), unsafe_allow_html=True)
+        st.download_button(
+            label="Download Student IDs",
+            data=result_store.artifact(run_key, f"Student_Ids{extension}", lambda: export_frame(table.iter_mapped(), export_format)),
+            file_name=f"Student_Ids{extension}",
+            mime=mime
+        )
         
         # Download button for teacher codes
-        st.markdown(download_link(teacher_codes, "School_Codes.xlsx", "Download School Codes"), unsafe_allow_html=True)
+        st.download_button(
+            label="Download School Codes",
+            data=result_store.artifact(run_key, f"School_Codes{extension}", lambda: export_frame(table.teacher_codes(), export_format)),
+            file_name=f"School_Codes{extension}",
+            mime=mime
+        )
 
     # if st.session_state['mapped_data'] is not None:
         # Centered title
@@ -601,99 +517,34 @@ def main():
         # Display the styled header
         st.markdown("<div class='custom-header'>Attendance Sheet Generator</div>", unsafe_allow_html=True)
 
-        image_path = "https://raw.githubusercontent.com/AniketParasher/pdfcreator/main/cg.png"
-
-        # Number of columns and column names for the table
-        column_names = ['S.NO', 'STUDENT ID', 'STUDENT NAME', 'GENDER', 'TAB ID', 'SESSION', 'SUBJECT 1', 'SUBJECT 2']
-        column_widths = {
-            'S.NO': 6,
-            'STUDENT ID': 15,
-            'STUDENT NAME': 60,
-            'GENDER': 10,
-            'TAB ID': 10,
-            'SESSION' : 23,
-            'SUBJECT 1': 24,
-            'SUBJECT 2': 24
-        }
-
         selected_option = st.selectbox("Choose your file naming format", list(naming_options.keys()))
         filename_template = naming_options[selected_option]
+
+        # Reprint a single school's sheet without rendering the whole zip
+        show_school_reprint(run_key, table, selected_option)
         
-        if st.button("Click to Generate PDFs and Zip"):
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                pdf_paths = []
-                preview_pdf_path = None  # To store the path of the first PDF
-        
-                # Create folders for districts
-                district_folders = {}
-                for record in result:
-                    district_name = record.get('District Name', 'default_district')
-                    if district_name not in district_folders:
-                        district_folder = os.path.join(tmp_dir, district_name)
-                        os.makedirs(district_folder, exist_ok=True)
-                        district_folders[district_name] = district_folder
-        
-                for index, record in enumerate(result):
-                    school_name = record.get('School Name', 'default_school')
-                    district_name = record.get('District Name', 'default_district')
-                    block_name = record.get('Block Name', 'default_block')
-                    grade = record.get('CLASS', 'default_grade')
-        
-                    file_name = filename_template.format(school_name=school_name, district_name=district_name, block_name=block_name, grade=grade)
-        
-                    pdf = FPDF(orientation='P', unit='mm', format='A4')
-                    pdf.set_left_margin(18)
-                    pdf.set_right_margin(18)
-        
-                    create_attendance_pdf(pdf, column_widths, column_names, image_path, record, df)
-        
-                    # Save the PDF in the appropriate district folder
-                    pdf_path = os.path.join(district_folders[district_name], f'{file_name}.pdf')
-                    pdf.output(pdf_path)
-                    pdf_paths.append(pdf_path)
-        
-                    if index == 0:  # Save the first PDF for preview
-                        preview_pdf_path = pdf_path
-
-                # Custom smaller header for PDF Preview
-                st.markdown(
-                    """
-                    <h3 style='text-align: left; font-size:24px; color:#4CAF50;'>PDF Preview</h3>
-                    """, 
-                    unsafe_allow_html=True
-                )
-                if preview_pdf_path:
-                    # Read the PDF file as binary
-                    with open(preview_pdf_path, "rb") as pdf_file:
-                        pdf_data = pdf_file.read()
-                        base64_pdf = base64.b64encode(pdf_data).decode('utf-8')
-                        # Create a download link for the PDF
-                        pdf_link = f'<a href="data:application/pdf;base64,{base64_pdf}" download="{os.path.basename(preview_pdf_path)}">Click here to download and view PDF</a>'
-                        
-                        # Display the link in Streamlit
-                        st.markdown(pdf_link, unsafe_allow_html=True)
-        
-                # Create a zip file containing all district folders
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                    for district_name, folder_path in district_folders.items():
-                        for foldername, _, filenames in os.walk(folder_path):
-                            for filename in filenames:
-                                filepath = os.path.join(foldername, filename)
-                                # Preserve directory structure in ZIP file
-                                arcname = os.path.relpath(filepath, tmp_dir)
-                                zip_file.write(filepath, arcname)
-        
-                zip_buffer.seek(0)  # Reset buffer position
+        # One PDF per school, or one multi-page PDF per district/block with a bookmark per school (smaller zip, faster to print)
+        layout = st.selectbox("PDF files", list(bundle_options))
+
+        # Number of worker processes used to render the PDFs in parallel, within this job's share of the server
+        max_workers = job_manager.workers_per_job()
+        pdf_workers = st.number_input("PDF Rendering Workers", min_value=1, max_value=max_workers, value=max_workers)
         
-                # Provide download link for the zip file
-                st.download_button(
-                    label="Click to Download Zip File",
-                    data=zip_buffer.getvalue(),
-                    file_name="attendance_Sheets.zip",
-                    mime="application/zip"
-                )
-                st.session_state['thank_you_displayed'] = True  # Set the thank you message state
+        if st.button("Click to Generate PDFs and Zip"):
+            # Render in the background on the server's job pool; the job ID is kept in the page URL so the
+            # result can still be fetched after a refresh
+            logo = logo_for_partner(st.session_state.get('partner_id', 1))
+            job_id = job_manager.submit('pdfs', render_zip_job, run_key, filename_template, logo, pdf_workers, performance_recorder(), bundle_options[layout])
+            st.session_state['pdf_job'] = job_id
+            st.query_params['job'] = job_id
+
+        if st.session_state.get('pdf_job'):
+            show_pdf_job(st.session_state['pdf_job'])
+
+    elif st.query_params.get('job'):
+        # A PDF job started before the page was refreshed
+        st.session_state['pdf_job'] = st.query_params['job']
+        show_pdf_job(st.session_state['pdf_job'])
 
 if __name__ == "__main__":
     main()
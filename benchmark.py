@@ -0,0 +1,180 @@
+# Stage-level benchmark of the ID + attendance pipeline on synthetic rosters.
+# The stages are those the app and CLI run (StudentTable, streamed Student_Ids, per-school rendering); --baseline
+# adds the old full student expansion for comparison. Every stage is timed on its own with its peak traced memory
+# and the results are written as JSON, so runs can be compared across commits:
+#     python benchmark.py --districts 30 --blocks 10 --schools 20 --students 40 -o bench.json
+import argparse
+import json
+import os
+import platform
+import struct
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import zlib
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import pipeline
+
+def make_roster(districts=10, blocks=5, schools=10, students=40, na_fraction=0.0, seed=0):
+    # Synthetic roster with `districts` districts, `blocks` blocks per district and `schools` schools per block.
+    # Student counts are Poisson around `students`; na_fraction of the rows get "NA" as District or Block,
+    # or a missing Total_Students.
+    rng = np.random.default_rng(seed)
+    rows = districts * blocks * schools
+    district = np.repeat(np.arange(1, districts + 1), blocks * schools)
+    block = np.repeat(np.arange(1, districts * blocks + 1), schools)
+    roster = pd.DataFrame({
+        'District': pd.Series(district).map(lambda d: f'District {d}'),
+        'Block': pd.Series(block).map(lambda b: f'Block {b}'),
+        'School_ID': np.arange(100001, 100001 + rows),
+        'School': [f'School {i}' for i in range(1, rows + 1)],
+        'Total_Students': rng.poisson(students, rows).astype(float)
+    })
+    if na_fraction > 0:
+        missing = rng.random(rows) < na_fraction
+        column = rng.integers(0, 3, rows)
+        roster.loc[missing & (column == 0), 'District'] = 'NA'
+        roster.loc[missing & (column == 1), 'Block'] = 'NA'
+        roster.loc[missing & (column == 2), 'Total_Students'] = np.nan
+    return roster
+
+def write_blank_png(path, width=60, height=20):
+    # Minimal white RGB PNG used as the logo, so benchmarks never depend on network access
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+    raw = b''.join(b'\x00' + b'\xff' * (width * 3) for _ in range(height))
+    with open(path, 'wb') as png_file:
+        png_file.write(b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+                       + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class StageTimer:
+    # Collects wall time, CPU time, row count and peak traced memory of each named stage
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = []
+
+    def run(self, name, function, rows=None):
+        if self.trace_memory:
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        value = function()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        peak = None
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        self.stages.append({
+            'stage': name,
+            'seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6),
+            'peak_bytes': peak,
+            'rows': rows(value) if callable(rows) else rows
+        })
+        return value
+
+def run_benchmark(roster, partner_id=1, buffer_percent=0.0, grade=1, district_digits=2, block_digits=2, school_digits=4,
+                  student_digits=3, selected_param='A4', naming='School Name + District Name', max_pdfs=None, workers=1,
+                  trace_memory=True, baseline=False):
+    # Times the path the app and CLI run: process_data()'s StudentTable, the streamed Student_Ids chunks, the grouped
+    # school records and the PDFs rendered with their IDs built per school. baseline also times the old full expansion
+    # (expand_students() .. group_students()) under baseline_stages, kept out of total_seconds, for comparison.
+    timer = StageTimer(trace_memory)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        roster_path = os.path.join(tmp_dir, 'roster.xlsx')
+        roster.to_excel(roster_path, index=False)
+        logo_path = os.path.join(tmp_dir, 'logo.png')
+        write_blank_png(logo_path)
+
+        data = timer.run('read_roster', lambda: pipeline.read_roster(roster_path), len)
+        data = timer.run('assign_ids', lambda: pipeline.assign_roster_ids(data, partner_id, buffer_percent, grade, district_digits, block_digits, school_digits), len)
+        timer.run('check_ids', lambda: pipeline.check_id_capacity(data, district_digits, block_digits, school_digits, student_digits, selected_param))
+        table = timer.run('student_table', lambda: pipeline.StudentTable(data, student_digits, selected_param), len)
+        timer.run('student_ids', lambda: sum(len(chunk) for chunk in table.iter_mapped()), lambda rows: rows)
+        timer.run('school_codes', table.teacher_codes, len)
+        result = timer.run('group_schools', table.school_records, len)
+        kpis = table.kpis()
+        records = result[:max_pdfs] if max_pdfs else result
+        rendered = timer.run('render_pdfs', lambda: list(pipeline.render_pdfs(records, None, pipeline.naming_options[naming], logo_path, workers,
+                                                                               student_ids=table.student_ids)), len)
+        zip_path = os.path.join(tmp_dir, 'attendance_Sheets.zip')
+        def package():
+            zip_file, written, _ = pipeline.package_zip(iter(rendered), zip_path)
+            zip_file.close()
+            return written
+        timer.run('package_zip', package, len)
+        zip_bytes = os.path.getsize(zip_path)
+
+        baseline_timer = StageTimer(trace_memory)
+        if baseline:
+            expanded = baseline_timer.run('baseline_expand_students', lambda: pipeline.expand_students(data, student_digits), len)
+            expanded = baseline_timer.run('baseline_custom_id', lambda: pipeline.compose_custom_ids(expanded, selected_param), len)
+            mapped, _ = baseline_timer.run('baseline_output_sheets', lambda: pipeline.build_output_sheets(data, expanded), lambda value: len(value[0]))
+            baseline_timer.run('baseline_group_students', lambda: pipeline.group_students(mapped), lambda value: len(value[1]))
+
+    report = {
+        'kpis': {label: int(value) for label, value in kpis.items()},
+        'zip_bytes': zip_bytes,
+        'stages': timer.stages,
+        'total_seconds': round(sum(stage['seconds'] for stage in timer.stages), 6)
+    }
+    if baseline:
+        report['baseline_stages'] = baseline_timer.stages
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark each pipeline stage on a synthetic roster and report JSON.")
+    parser.add_argument('--districts', type=int, default=10)
+    parser.add_argument('--blocks', type=int, default=5, help="Blocks per district")
+    parser.add_argument('--schools', type=int, default=10, help="Schools per block")
+    parser.add_argument('--students', type=int, default=40, help="Mean students per school")
+    parser.add_argument('--na-fraction', type=float, default=0.0, help="Share of rows with an NA District/Block/Total_Students")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--param', default='A4', choices=list(pipeline.parameter_mapping))
+    parser.add_argument('--max-pdfs', type=int, help="Render only the first N schools")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes used to render the PDFs")
+    parser.add_argument('--baseline', action='store_true', help="Also time the old full student expansion, reported as baseline_stages")
+    parser.add_argument('--no-memory', dest='trace_memory', action='store_false', help="Skip tracemalloc (faster, no peak memory)")
+    parser.add_argument('--save-roster', help="Also write the synthetic roster to this .xlsx/.csv path")
+    parser.add_argument('-o', '--output', help="JSON result file (default: stdout)")
+    args = parser.parse_args(argv)
+
+    roster = make_roster(args.districts, args.blocks, args.schools, args.students, args.na_fraction, args.seed)
+    if args.save_roster:
+        if args.save_roster.lower().endswith('.csv'):
+            roster.to_csv(args.save_roster, index=False)
+        else:
+            roster.to_excel(args.save_roster, index=False)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'save_roster')},
+        'roster_rows': len(roster)
+    }
+    report.update(run_benchmark(roster, selected_param=args.param, max_pdfs=args.max_pdfs, workers=args.workers, trace_memory=args.trace_memory,
+                                baseline=args.baseline))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Persistent ID registry backed by a local SQLite file.
+# District, block and school IDs are allocated once per partner and then reused by every later run, so adding a
+# school or re-sorting the roster only allocates IDs for the new entities. Student ranges per school and grade
+# only ever grow, and a content-hash manifest of the rendered sheets lets a rerun re-render only the sheets that
+# changed. On an empty registry the IDs come out exactly as assign_ids() numbers them.
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+schema = """
+CREATE TABLE IF NOT EXISTS entity_ids (
+    partner TEXT NOT NULL,
+    level TEXT NOT NULL,
+    key TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (partner, level, key)
+);
+CREATE TABLE IF NOT EXISTS student_ranges (
+    partner TEXT NOT NULL,
+    grade TEXT NOT NULL,
+    school TEXT NOT NULL,
+    allocated INTEGER NOT NULL,
+    PRIMARY KEY (partner, grade, school)
+);
+CREATE TABLE IF NOT EXISTS pdf_manifest (
+    scope TEXT NOT NULL,
+    arcname TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    PRIMARY KEY (scope, arcname)
+);
+"""
+
+# Registry key of blank cells. Like factorize(use_na_sentinel=False), blank cells and "NA" take an ID slot of
+# their own (so the numbering matches a fresh run) but are written out as 0.
+blank_key = '\x00blank'
+
+class IdRegistry:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(path, timeout=30)
+        try:
+            connection.executescript(schema)
+        finally:
+            connection.close()
+
+    @contextmanager
+    def transaction(self):
+        # One short-lived connection per transaction, so sessions on different threads can share the registry.
+        # BEGIN IMMEDIATE takes the write lock up front so two processes never allocate the same ID.
+        with self.lock:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            try:
+                connection.execute('BEGIN IMMEDIATE')
+                yield connection
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            finally:
+                connection.close()
+
+    def assign(self, partner_id, level, values):
+        # IDs of values (a Series) at one hierarchy level, allocating the next free IDs for unseen values
+        # in order of first appearance; "NA" and blank cells map to 0
+        keys = values.astype(object).where(values.notna(), blank_key).astype(str)
+        partner = str(partner_id)
+        with self.transaction() as connection:
+            known = dict(connection.execute('SELECT key, id FROM entity_ids WHERE partner = ? AND level = ?', (partner, level)))
+            next_id = max(known.values(), default=0) + 1
+            new_keys = [key for key in pd.unique(keys) if key not in known]
+            for offset, key in enumerate(new_keys):
+                known[key] = next_id + offset
+            connection.executemany('INSERT INTO entity_ids (partner, level, key, id) VALUES (?, ?, ?, ?)',
+                                   [(partner, level, key, known[key]) for key in new_keys])
+        missing = (keys == blank_key).to_numpy() | (keys == 'NA').to_numpy()
+        return np.where(missing, 0, keys.map(known).to_numpy(dtype=np.int64))
+
+    def reserve_students(self, partner_id, grades, schools, counts):
+        # Student slots per school row: the larger of the slots allocated by earlier runs and counts, so a
+        # school whose roll count dropped keeps the IDs already handed out. Schools are identified by their
+        # District, Block and School_ID columns and grades (a scalar or one grade per row); rows without a
+        # School_ID keep counts.
+        counts = np.asarray(counts, dtype=float)
+        grades = np.broadcast_to(np.asarray(grades, dtype=object), counts.shape).astype(str)
+        school_ids = schools['School_ID'].astype(object).to_numpy()
+        keys = schools[['District', 'Block', 'School_ID']].astype(object).where(schools.notna(), blank_key).astype(str).agg('\x1f'.join, axis=1).to_numpy()
+        known = ~pd.isna(school_ids) & (school_ids != 'NA')
+        partner = str(partner_id)
+        with self.transaction() as connection:
+            allocated = {(grade, school): count for school, grade, count in
+                         connection.execute('SELECT school, grade, allocated FROM student_ranges WHERE partner = ?', (partner,))}
+            previous = np.array([allocated.get((grade, key), np.nan) if has_key else np.nan
+                                 for grade, key, has_key in zip(grades, keys, known)], dtype=float)
+            reserved = np.fmax(counts, previous)
+            largest = {}
+            for grade, key, count in zip(grades[known], keys[known], reserved[known]):
+                if not np.isnan(count):
+                    largest[(grade, key)] = max(count, largest.get((grade, key), count))
+            connection.executemany(
+                'INSERT INTO student_ranges (partner, grade, school, allocated) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (partner, grade, school) DO UPDATE SET allocated = MAX(allocated, excluded.allocated)',
+                [(partner, grade, school, int(count)) for (grade, school), count in largest.items()]
+            )
+        return reserved
+
+    def manifest(self, scope):
+        # {arcname: content hash} of the sheets last written to scope (e.g. a zip path)
+        with self.transaction() as connection:
+            return dict(connection.execute('SELECT arcname, content_hash FROM pdf_manifest WHERE scope = ?', (scope,)))
+
+    def save_manifest(self, scope, hashes):
+        # Replace the manifest of scope with the sheets just written
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM pdf_manifest WHERE scope = ?', (scope,))
+            connection.executemany('INSERT INTO pdf_manifest (scope, arcname, content_hash) VALUES (?, ?, ?)',
+                                   [(scope, arcname, content_hash) for arcname, content_hash in hashes.items()])
+
+def default_registry():
+    # Registry named by the ATTENDANCE_ID_REGISTRY environment variable, or None to number every run from scratch
+    path = os.environ.get('ATTENDANCE_ID_REGISTRY')
+    return IdRegistry(path) if path else None
@@ -0,0 +1,157 @@
+# Lightweight per-stage instrumentation of the pipeline.
+# Stages are marked with @timed_stage / @timed_iterator and are only measured while a StageRecorder is active
+# (see recording()); otherwise the hook costs a single context variable lookup. Each stage records wall time,
+# CPU time, row count, the change in resident memory while it ran and the process' RSS high-water mark, and every
+# record is also logged as one JSON line.
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger('attendance.performance')
+
+try:
+    page_size = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):  # Windows
+    page_size = 4096
+
+active_recorder = contextvars.ContextVar('active_recorder', default=None)
+
+def current_rss_bytes():
+    # Resident set size of this process right now, from /proc (None where it is unavailable, e.g. macOS, Windows)
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * page_size
+    except (OSError, ValueError, IndexError):
+        return None
+
+def rss_change(started):
+    # Bytes the resident set grew (or shrank) by since started (None when RSS is unavailable)
+    current = current_rss_bytes()
+    return None if started is None or current is None else current - started
+
+def peak_rss_bytes():
+    # Peak resident set size of this process so far (None where the resource module is unavailable). It is the
+    # high-water mark of the whole process (every session of a shared server), not of one stage.
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class StageRecorder:
+    # Stage records in completion order. Time spent in a nested stage is left out of the stage around it,
+    # so the records of a run add up without double counting.
+    def __init__(self, log=True):
+        self.records = []
+        self.log = log
+        self.open_stages = []
+
+    def start(self, name):
+        frame = {'stage': name, 'wall': time.perf_counter(), 'cpu': time.process_time(), 'nested_wall': 0.0, 'nested_cpu': 0.0,
+                 'rss': current_rss_bytes()}
+        self.open_stages.append(frame)
+        return frame
+
+    def finish(self, frame, rows=None):
+        wall = time.perf_counter() - frame['wall']
+        cpu = time.process_time() - frame['cpu']
+        self.open_stages.remove(frame)
+        self.charge(wall, cpu)
+        return self.record(frame['stage'], wall - frame['nested_wall'], cpu - frame['nested_cpu'], rows, rss_change(frame['rss']))
+
+    def charge(self, wall, cpu):
+        # Count time spent in a nested stage against the innermost open stage
+        if self.open_stages:
+            self.open_stages[-1]['nested_wall'] += wall
+            self.open_stages[-1]['nested_cpu'] += cpu
+
+    def record(self, name, wall, cpu, rows=None, rss_change_bytes=None):
+        # rss_change_bytes: growth of the resident set from the start to the end of the stage (nested stages included)
+        record = {
+            'stage': name,
+            'seconds': round(wall, 6),
+            'cpu_seconds': round(cpu, 6),
+            'rows': rows,
+            'rss_change_bytes': rss_change_bytes,
+            'process_peak_rss_bytes': peak_rss_bytes()
+        }
+        self.records.append(record)
+        if self.log:
+            logger.info(json.dumps(record))
+        return record
+
+    def total_seconds(self):
+        return round(sum(record['seconds'] for record in self.records), 6)
+
+@contextmanager
+def recording(recorder):
+    # Measure the stages run inside the block with recorder; recording(None) leaves instrumentation off
+    if recorder is None:
+        yield None
+        return
+    token = active_recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        active_recorder.reset(token)
+
+def timed_stage(name, rows=None):
+    # Decorator for a pipeline stage; rows(result) gives the row count to record
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = active_recorder.get()
+            if recorder is None:
+                return function(*args, **kwargs)
+            frame = recorder.start(name)
+            value = None
+            try:
+                value = function(*args, **kwargs)
+                return value
+            finally:
+                recorder.finish(frame, rows(value) if rows is not None and value is not None else None)
+        return wrapper
+    return decorate
+
+def timed_iterator(name):
+    # Decorator for a generator stage: records the time spent producing its items, with the item count as rows,
+    # once the generator is exhausted or closed
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            recorder = active_recorder.get()
+            if recorder is None:
+                return function(*args, **kwargs)
+            return timed_items(recorder, name, function(*args, **kwargs))
+        return wrapper
+    return decorate
+
+def timed_items(recorder, name, items):
+    wall = cpu = 0.0
+    count = 0
+    started_rss = current_rss_bytes()
+    try:
+        while True:
+            started_wall, started_cpu = time.perf_counter(), time.process_time()
+            item = next(items, StopIteration)
+            step_wall = time.perf_counter() - started_wall
+            step_cpu = time.process_time() - started_cpu
+            wall += step_wall
+            cpu += step_cpu
+            # The consumer's stage (e.g. package_zip) is open while items are produced
+            recorder.charge(step_wall, step_cpu)
+            if item is StopIteration:
+                break
+            count += 1
+            yield item
+    finally:
+        recorder.record(name, wall, cpu, count, rss_change(started_rss))
@@ -0,0 +1,190 @@
+# Background jobs for long generation runs.
+# Jobs run on process-wide thread pools, so at most ATTENDANCE_MAX_JOBS run at a time across every session and
+# the rest wait in a queue. Short jobs the page waits for (ID generation) have their own lane of
+# ATTENDANCE_MAX_QUICK_JOBS threads, so they never queue behind long PDF renders. A job reports progress, can be cancelled, and keeps its status and artifacts under
+# ATTENDANCE_JOB_DIR/<job id>/ (job.json plus the files it wrote), so a finished job can still be fetched after a
+# rerun, a browser refresh or a server restart. Finished jobs are removed after ATTENDANCE_JOB_TTL seconds.
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+final_statuses = ('done', 'failed', 'cancelled')
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    # State of one job; the job function receives it to report progress and to name its artifact files
+    def __init__(self, job_id, kind, directory):
+        self.id = job_id
+        self.kind = kind
+        self.directory = directory
+        self.status = 'queued'
+        self.done = 0
+        self.total = 0
+        self.error = None
+        self.error_type = None
+        self.result = {}
+        self.created = time.time()
+        self.finished = None
+        self.cancel_requested = threading.Event()
+        self.future = None
+
+    def progress(self, done, total):
+        # Progress callback for the pipeline; raising here is how a running job stops once cancelled
+        self.done, self.total = done, total
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+
+    def check_cancelled(self):
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+
+    def artifact_path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+    def snapshot(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'error': self.error,
+            'error_type': self.error_type,
+            'result': self.result,
+            'created': self.created,
+            'finished': self.finished
+        }
+
+class JobManager:
+    def __init__(self, max_jobs, job_dir, ttl_seconds=86400, max_quick_jobs=2, quick_kinds=('ids',)):
+        self.max_jobs = max_jobs
+        self.job_dir = job_dir
+        self.ttl_seconds = ttl_seconds
+        self.quick_kinds = quick_kinds
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='attendance-job')
+        self.quick_executor = ThreadPoolExecutor(max_workers=max_quick_jobs, thread_name_prefix='attendance-quick-job')
+
+    def workers_per_job(self):
+        # PDF worker processes a job may start, so concurrent jobs together do not oversubscribe the CPUs
+        return max(1, (os.cpu_count() or 1) // self.max_jobs)
+
+    def submit(self, kind, function, *args):
+        # Queue function(job, *args) and return the job ID. The function returns a JSON-serializable result
+        # dict (e.g. the artifact file names it wrote) and should call job.progress() as it goes.
+        self.cleanup()
+        job_id = uuid.uuid4().hex[:12]
+        job = Job(job_id, kind, os.path.join(self.job_dir, job_id))
+        os.makedirs(job.directory, exist_ok=True)
+        with self.lock:
+            self.jobs[job_id] = job
+        self.save(job)
+        executor = self.quick_executor if kind in self.quick_kinds else self.executor
+        job.future = executor.submit(self.run, job, function, args)
+        return job_id
+
+    def run(self, job, function, args):
+        if job.cancel_requested.is_set():
+            self.finish(job, 'cancelled')
+            return
+        job.status = 'running'
+        self.save(job)
+        try:
+            job.result = function(job, *args) or {}
+            self.finish(job, 'done')
+        except JobCancelled:
+            self.finish(job, 'cancelled')
+        except Exception as e:
+            job.error, job.error_type = str(e), type(e).__name__
+            self.finish(job, 'failed')
+
+    def finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+        self.save(job)
+
+    def save(self, job):
+        # Write job.json atomically so a reader never sees a half-written status
+        fd, partial_path = tempfile.mkstemp(dir=job.directory, suffix='.part')
+        with os.fdopen(fd, 'w') as status_file:
+            json.dump(job.snapshot(), status_file, default=str)
+        os.replace(partial_path, os.path.join(job.directory, 'job.json'))
+
+    def get(self, job_id):
+        # Status dict of a job, from memory or from its job.json on disk (jobs of an earlier server process); None if unknown
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job.snapshot()
+        status_path = os.path.join(self.job_dir, os.path.basename(str(job_id)), 'job.json')
+        if not os.path.exists(status_path):
+            return None
+        with open(status_path) as status_file:
+            snapshot = json.load(status_file)
+        if snapshot['status'] not in final_statuses:
+            # Still marked as queued or running, but no longer in this process: the server stopped while it ran
+            snapshot.update(status='failed', error="The server restarted before the job finished", error_type='Interrupted')
+        return snapshot
+
+    def wait(self, job_id, timeout=None):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None and job.future is not None:
+            try:
+                job.future.result(timeout)
+            except Exception:
+                pass
+        return self.get(job_id)
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None or job.status in final_statuses:
+            return False
+        job.cancel_requested.set()
+        if job.future is not None and job.future.cancel():
+            # Still queued: it will never start
+            self.finish(job, 'cancelled')
+        return True
+
+    def queue_position(self, job_id):
+        # Number of queued jobs of the same lane submitted before this one (0 once it runs)
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != 'queued':
+                return 0
+            quick = job.kind in self.quick_kinds
+            return sum(1 for other in self.jobs.values()
+                       if other.status == 'queued' and (other.kind in self.quick_kinds) == quick and other.created < job.created)
+
+    def artifact_path(self, job_id, file_name):
+        return os.path.join(self.job_dir, os.path.basename(str(job_id)), os.path.basename(file_name))
+
+    def cleanup(self):
+        # Remove finished jobs, in memory and on disk, once they are older than the retention period
+        if not os.path.isdir(self.job_dir):
+            return
+        cutoff = time.time() - self.ttl_seconds
+        for job_id in os.listdir(self.job_dir):
+            snapshot = self.get(job_id)
+            if snapshot is None or snapshot['status'] not in final_statuses or (snapshot['finished'] or snapshot['created']) >= cutoff:
+                continue
+            shutil.rmtree(os.path.join(self.job_dir, job_id), ignore_errors=True)
+            with self.lock:
+                self.jobs.pop(job_id, None)
+
+# Process-wide job manager shared by every session; the limits can be tuned per deployment through the environment
+job_manager = JobManager(
+    max_jobs=int(os.environ.get('ATTENDANCE_MAX_JOBS', 2)),
+    job_dir=os.environ.get('ATTENDANCE_JOB_DIR', os.path.join(tempfile.gettempdir(), 'attendance_jobs')),
+    ttl_seconds=int(os.environ.get('ATTENDANCE_JOB_TTL', 86400)),
+    max_quick_jobs=int(os.environ.get('ATTENDANCE_MAX_QUICK_JOBS', 2))
+)
@@ -0,0 +1,83 @@
+# Managed store for the static images placed on the attendance sheets.
+# A logo resolves once to a local file (a local path, a file bundled under assets/, or a URL downloaded once
+# into the asset cache directory), is decoded once per process and is then shared by every PDF of a run.
+# Logos bundled with the code need no network access at all (see assets/README.md):
+#     assets/logo.png             default logo, used instead of the remote one when present
+#     assets/partner_<id>.png     logo of partner <id> (e.g. assets/partner_2.png), used instead of the default
+import hashlib
+import os
+import tempfile
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+# Bundled images shipped next to the code, e.g. assets/logo.png or assets/partner_<id>.png
+asset_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+# Where remote images are stored after their first download, so later runs work without network access
+asset_cache_dir = os.environ.get('ATTENDANCE_ASSET_CACHE', os.path.join(tempfile.gettempdir(), 'attendance_assets'))
+
+# Default logo when none is bundled, downloaded once into the asset cache
+remote_logo = "https://raw.githubusercontent.com/AniketParasher/pdfcreator/main/cg.png"
+# Default logo set per deployment (a local path or URL); takes precedence over assets/logo.png and remote_logo
+configured_logo = os.environ.get('ATTENDANCE_LOGO_URL')
+
+# Logo source per partner ID; partners without an entry use assets/partner_<id>.png when it exists, else the default logo
+partner_logos = {}
+
+# Decoded images keyed by source, filled on first use and handed to the PDF worker processes
+decoded_images = {}
+
+def default_logo():
+    if configured_logo:
+        return configured_logo
+    bundled = os.path.join(asset_dir, 'logo.png')
+    return bundled if os.path.exists(bundled) else remote_logo
+
+def logo_for_partner(partner_id):
+    if str(partner_id) in partner_logos:
+        return partner_logos[str(partner_id)]
+    bundled = os.path.join(asset_dir, f'partner_{partner_id}.png')
+    return bundled if os.path.exists(bundled) else default_logo()
+
+def resolve_asset(source):
+    # Return a local file for source, downloading remote images into the cache directory the first time
+    if source.startswith(('http://', 'https://')):
+        extension = os.path.splitext(urlparse(source).path)[1] or '.png'
+        local_path = os.path.join(asset_cache_dir, hashlib.sha1(source.encode()).hexdigest() + extension)
+        if not os.path.exists(local_path):
+            os.makedirs(asset_cache_dir, exist_ok=True)
+            with urlopen(source, timeout=30) as response:
+                data = response.read()
+            # Write to a temporary name first so concurrent runs never read a half-written file
+            partial_path = f'{local_path}.{os.getpid()}.part'
+            with open(partial_path, 'wb') as partial_file:
+                partial_file.write(data)
+            os.replace(partial_path, local_path)
+        return local_path
+    if not os.path.exists(source) and os.path.exists(os.path.join(asset_dir, source)):
+        return os.path.join(asset_dir, source)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"Image not found: {source}")
+    return source
+
+def load_image(source):
+    # Resolve and decode an image once per process; returns (local path, fpdf image info)
+    if source not in decoded_images:
+        from fpdf import FPDF  # Deferred so the app starts without loading the PDF library
+        path = resolve_asset(source)
+        parser = FPDF()
+        extension = os.path.splitext(path)[1].lower()
+        if extension in ('.jpg', '.jpeg'):
+            info = parser._parsejpg(path)
+        elif extension == '.gif':
+            info = parser._parsegif(path)
+        else:
+            info = parser._parsepng(path)
+        decoded_images[source] = (path, info)
+    return decoded_images[source]
+
+def place_image(pdf, source, x, y, w, h):
+    # Register the already decoded image on this document (fpdf only parses images it has not seen) and draw it
+    path, info = load_image(source)
+    if path not in pdf.images:
+        pdf.images[path] = dict(info, i=len(pdf.images) + 1)
+    pdf.image(path, x=x, y=y, w=w, h=h)
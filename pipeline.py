@@ -0,0 +1,1255 @@
+# Headless ID generation and attendance sheet pipeline.
+# Every stage can be called on its own; process_data() and run_pipeline() chain them end to end.
+# The Streamlit app (4thseptv3.py) is a thin client of this module and the CLI below runs it without a browser.
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from id_registry import IdRegistry
+from instrumentation import StageRecorder, recording, timed_iterator, timed_stage
+from pdf_assets import decoded_images, default_logo, load_image, logo_for_partner, place_image
+from roster_io import export_formats, load_roster, write_export
+
+# Define the parameter descriptions
+parameter_descriptions = {
+    'A1': "School + Grade + Student",
+    'A2': "Block + School + Grade + Student",
+    'A3': "District + School + Grade + Student",
+    'A4': "Partner + School + Grade + Student",
+    'A5': "District + Block + School + Grade + Student",
+    'A6': "Partner + Block + School + Grade + Student",
+    'A7': "Partner + District + School + Grade + Student",
+    'A8': "Partner + District + Block + School + Grade + Student"
+}
+
+# Define the new mapping for parameter sets
+parameter_mapping = {
+    'A1': "School_ID,Grade,student_no",
+    'A2': "Block_ID,School_ID,Grade,student_no",
+    'A3': "District_ID,School_ID,Grade,student_no",
+    'A4': "Partner_ID,School_ID,Grade,student_no",
+    'A5': "District_ID,Block_ID,School_ID,Grade,student_no",
+    'A6': "Partner_ID,Block_ID,School_ID,Grade,student_no",
+    'A7': "Partner_ID,District_ID,School_ID,Grade,student_no",
+    'A8': "Partner_ID,District_ID,Block_ID,School_ID,Grade,student_no"
+}
+
+# Dropdown for selecting file naming format
+naming_options = {
+    "School Name + District Name": "{school_name}_{district_name}",
+    "School Name + Block Name": "{school_name}_{block_name}",
+    "School Name + Grade": "{school_name}_Grade{grade}"
+}
+
+# Output layout of the attendance sheets: one PDF per school, or one multi-page PDF per district or block
+# with a bookmark per school
+bundle_options = {
+    "One PDF per school": None,
+    "One PDF per district": 'district',
+    "One PDF per block": 'block'
+}
+
+logger = logging.getLogger('attendance.pipeline')
+
+# Default logo; see pdf_assets for bundled/per-partner logos and the local cache of remote images
+image_path = default_logo()
+
+# Number of columns and column names for the table
+column_names = ['S.NO', 'STUDENT ID', 'STUDENT NAME', 'GENDER', 'TAB ID', 'SESSION', 'SUBJECT 1', 'SUBJECT 2']
+column_widths = {
+    'S.NO': 6,
+    'STUDENT ID': 15,
+    'STUDENT NAME': 60,
+    'GENDER': 10,
+    'TAB ID': 10,
+    'SESSION' : 23,
+    'SUBJECT 1': 24,
+    'SUBJECT 2': 24
+}
+
+@lru_cache(maxsize=None)
+def compile_custom_id(params):
+    # Compile a parameter set (a key of parameter_mapping or a user-defined "Col1,Col2,..." string)
+    # once into the ordered tuple of columns that are concatenated into the Custom_ID
+    params = parameter_mapping.get(params, params)
+    return tuple(param.strip() for param in params.split(',') if param.strip())
+
+def format_id_part(values):
+    # Render a whole column as ID text: whole-number floats drop their ".0" and missing values contribute nothing
+    if pd.api.types.is_float_dtype(values):
+        whole = (values % 1 == 0).to_numpy()
+        text = values.astype(str).where(~whole, values.where(whole).astype('Int64').astype(str))
+    else:
+        text = values.astype(str)
+    return text.where(values.notna(), '')
+
+def generate_custom_id(data, params):
+    # Build the Custom_ID column with one vectorized concatenation per column of the compiled plan
+    custom_id = pd.Series('', index=data.index, dtype=str)
+    for column in compile_custom_id(params):
+        if column in data.columns:
+            custom_id = custom_id + format_id_part(data[column])
+    return custom_id
+
+def custom_id_templates(rows, selected_param, has_students):
+    # Custom_ID text of each school row, with '\x00' in place of the student_no part and '\x01' in place of the student
+    # number inside Student_IDs; rows where has_students is False get no student part, as their single ID has none.
+    # Shared by check_id_capacity() (two rows collide when their templates are equal) and StudentTable.id_templates(),
+    # so the collision check always describes the IDs that are actually written.
+    template = pd.Series('', index=rows.index, dtype=str)
+    for column in compile_custom_id(selected_param):
+        if column == 'student_no':
+            template = template + pd.Series('\x00', index=rows.index, dtype=str).where(has_students, '')
+        elif column == 'Student_IDs':
+            student_ids = rows['School_ID'].astype(str) + rows['Grade'].astype(int).astype(str).str.zfill(2) + '\x01'
+            template = template + student_ids.where(has_students, '')
+        elif column in rows.columns:
+            template = template + format_id_part(rows[column])
+    return template
+
+def assign_ids(values, digits):
+    # Number values by order of first appearance in a single factorize pass and zero-pad them.
+    # "NA" (and blank cells, which read_excel loads as NaN) keep their slot in the ordering but map to zero.
+    codes, _ = pd.factorize(values, use_na_sentinel=False)
+    missing = values.isna().to_numpy() | (values.astype(object) == "NA").to_numpy()
+    ids = np.where(missing, 0, codes + 1)
+    return pd.Series(ids, index=values.index).astype(str).str.zfill(digits)
+
+def school_student_counts(data):
+    # Student numbers per school row (the buffered count, 0 when missing)
+    return data['Total_Students_With_Buffer'].fillna(0).clip(lower=0).to_numpy().astype(np.int64)
+
+@timed_stage('student_positions', rows=lambda positions: len(positions[0]))
+def student_positions(data):
+    return positions_from_counts(school_student_counts(data))
+
+def positions_from_counts(counts):
+    # Per student row: the position of its school row and its 1-based number within the school (0 for the single
+    # row a school without students keeps, exactly like explode does for empty lists), built with repeat/offset arrays
+    repeats = np.maximum(counts, 1)
+    school_index = np.repeat(np.arange(len(counts), dtype=np.int32), repeats)
+    offsets = np.repeat(np.cumsum(repeats) - repeats, repeats)
+    student_seq = (np.arange(len(school_index)) - offsets + 1).astype(np.int32)
+    student_seq[~np.repeat(counts > 0, repeats)] = 0
+    return school_index, student_seq
+
+def student_id_columns(student_rows, student_seq, student_digits):
+    # Student_IDs (School_ID + 2-digit Grade + zero-padded student number) and student_no text of student rows,
+    # missing where a school has no students
+    has_students = student_seq > 0
+    padded = pd.Series(np.maximum(student_seq, 1), index=student_rows.index).astype(str).str.zfill(student_digits)
+    grade = student_rows['Grade'].astype(int).astype(str).str.zfill(2)
+    student_ids = student_rows['School_ID'].astype(str) + grade + padded
+    # Extract student number from the ID
+    return student_ids.where(has_students), padded.str[-student_digits:].where(has_students)
+
+@timed_stage('expand_students', rows=len)
+def expand_students(data, student_digits):
+    # Expand each school row into one row per student
+    school_index, student_seq = student_positions(data)
+    data_expanded = data.iloc[school_index].copy()
+    data_expanded['Student_IDs'], data_expanded['student_no'] = student_id_columns(data_expanded, student_seq, student_digits)
+    return data_expanded
+
+@timed_stage('read_roster', rows=len)
+def read_roster(source, report=None):
+    # Stage 1: load the roster from an uploaded file object or a local .xlsx/.csv/.parquet path.
+    # When a dict is passed as report it is filled with the format, reader engine, row count and load time.
+    data, load_report = load_roster(source)
+    if report is not None:
+        report.update(load_report)
+    return data
+
+def parse_grades(value, default):
+    # Grades listed in one roster cell: "3", "1,2,3", "1-5" or a mix such as "1, 3-5"; blank cells use default
+    if pd.isna(value) or str(value).strip() == '':
+        return [default]
+    grades = []
+    for part in str(value).replace(';', ',').split(','):
+        part = part.strip()
+        if '-' in part:
+            first, last = (int(float(bound)) for bound in part.split('-', 1))
+            grades.extend(range(first, last + 1))
+        elif part:
+            grades.append(int(float(part)))
+    if not grades:
+        raise ValueError(f"Invalid grade: {value!r}")
+    return grades
+
+def roster_grades(values, default):
+    # Grade list of every roster row, parsing each distinct cell once
+    try:
+        parsed = {value: parse_grades(value, default) for value in pd.unique(values)}
+    except ValueError as e:
+        raise ValueError(f"Invalid value in the Grade column: {e}") from None
+    return values.map(parsed)
+
+@timed_stage('assign_ids', rows=len)
+def assign_roster_ids(data, partner_id, buffer_percent, grade, district_digits, block_digits, school_digits, registry=None):
+    # Stage 2: stamp Partner_ID/Grade, assign hierarchy IDs and the buffered student count on the school rows.
+    # With an IdRegistry the IDs and student ranges of entities seen in earlier runs are reused.
+    # A roster with a Grade column gets one row per school and listed grade (cells without a grade use grade);
+    # the IDs are assigned on the roster rows first so every grade of a school shares them, and Total_Students
+    # is the count per grade. The grade rows of a school keep its roster index.
+    data = data.copy()
+    # Assign the Partner_ID directly
+    data['Partner_ID'] = str(partner_id).zfill(len(str(partner_id)))  # Padding Partner_ID
+    multi_grade = 'Grade' in data.columns
+    data['Grade'] = roster_grades(data['Grade'], grade) if multi_grade else grade
+    schools = data[['District', 'Block', 'School_ID']]
+    # Assign unique IDs for District, Block, and School, default to "00" for missing values
+    hierarchy_levels = [
+        ('District_ID', 'District', district_digits),
+        ('Block_ID', 'Block', block_digits),
+        ('School_ID', 'School_ID', school_digits)
+    ]
+    for id_column, source_column, digits in hierarchy_levels:
+        if registry is None:
+            data[id_column] = assign_ids(data[source_column], digits)
+        else:
+            ids = registry.assign(partner_id, source_column, data[source_column])
+            data[id_column] = pd.Series(ids, index=data.index).astype(str).str.zfill(digits)
+    if multi_grade:
+        data = data.explode('Grade')
+        data['Grade'] = data['Grade'].astype(np.int64)
+        schools = schools.loc[data.index]
+    # Calculate Total Students With Buffer based on the provided buffer percentage
+    data['Total_Students_With_Buffer'] = np.floor(data['Total_Students'] * (1 + buffer_percent / 100))
+    if registry is not None:
+        data['Total_Students_With_Buffer'] = registry.reserve_students(partner_id, data['Grade'], schools, data['Total_Students_With_Buffer'])
+    return data
+
+@timed_stage('custom_id', rows=len)
+def compose_custom_ids(data_expanded, selected_param):
+    # Stage 4: use the selected parameter set for generating Custom_ID
+    data_expanded['Custom_ID'] = generate_custom_id(data_expanded, selected_param)
+    return data_expanded
+
+class IdCapacityError(ValueError):
+    # Raised before expansion when the configured digits cannot hold the roster; problems lists every finding
+    def __init__(self, problems):
+        super().__init__("The ID settings do not fit this roster:\n" + "\n".join(f"- {problem}" for problem in problems))
+        self.problems = problems
+
+@timed_stage('validate_ids')
+def check_id_capacity(data, district_digits, block_digits, school_digits, student_digits, selected_param):
+    # Check the school rows produced by assign_roster_ids() in O(schools) before anything is expanded:
+    # every hierarchy ID and buffered student count must fit its digits, and no two students may end up with the
+    # same Custom_ID. Returns a list of problems (empty when the configuration is safe).
+    problems = []
+    id_levels = [
+        ('District_ID', 'District', 'District ID Digits', district_digits),
+        ('Block_ID', 'Block', 'Block ID Digits', block_digits),
+        ('School_ID', 'School', 'School ID Digits', school_digits)
+    ]
+    plan = compile_custom_id(selected_param)
+    for id_column, label, setting, digits in id_levels:
+        # School IDs are also exported as the School Code; district and block IDs only appear inside the Custom_ID
+        if id_column != 'School_ID' and id_column not in plan:
+            continue
+        width = data[id_column].str.len().max() if len(data) else 0
+        if width > digits:
+            problems.append(f"{label}: IDs go up to {data[id_column].astype(int).max()}, which needs {width} digits, "
+                            f"but {setting} is {digits} (at most {10 ** digits - 1})")
+
+    counts = data['Total_Students_With_Buffer'].fillna(0).to_numpy()
+    capacity = 10 ** student_digits - 1
+    over = counts > capacity
+    if over.any():
+        examples = ', '.join(f"{school} ({int(count)})" for school, count in zip(data['School'].to_numpy()[over][:5], counts[over][:5]))
+        problems.append(f"Total_Students: {int(over.sum())} school row(s) need more than {capacity} student numbers including the buffer, "
+                        f"but Student ID Digits is {student_digits}; e.g. {examples}")
+
+    # A Custom_ID is the school-level text of the plan with the student number inserted, so two school rows with
+    # students collide exactly when their school-level text is equal (for plans ending in the student part, as A1-A8 do)
+    rows = data[counts > 0]
+    plan_name = parameter_descriptions.get(selected_param, selected_param)
+    template = custom_id_templates(rows, selected_param, np.ones(len(rows), dtype=bool))
+    per_student = 'student_no' in plan or 'Student_IDs' in plan
+    if not per_student and (counts > 1).any():
+        problems.append(f"Custom_ID ({plan_name}) has no student part, so all students of a school get the same ID")
+    shared = template.duplicated(keep=False).to_numpy()
+    if shared.any():
+        colliding = rows[shared].assign(template=template.to_numpy()[shared])
+        examples = ['; '.join(f"{school} ({district}, {block})" for school, district, block in group[['School', 'District', 'Block']].head(3).itertuples(index=False))
+                    for _, group in islice(colliding.groupby('template', sort=False), 3)]
+        problems.append(f"Custom_ID ({plan_name}): {int(shared.sum())} school rows share their ID digits with another school row, "
+                        f"so their students would get the same IDs. Check for duplicate or missing School_IDs, or pick a parameter set "
+                        f"with more levels; e.g. " + ' | '.join(examples))
+    return problems
+
+def student_sheet(data_expanded):
+    # Generate the additional Excel sheets with mapped columns (without the Gender column)
+    data_mapped = data_expanded[['Custom_ID', 'Grade', 'School', 'School_ID', 'District', 'Block']].copy()
+    data_mapped.columns = ['Roll_Number', 'Grade', 'School Name', 'School Code', 'District Name', 'Block Name']
+    return data_mapped
+
+def school_code_sheet(data):
+    # Generate Teacher_Codes sheet, one row per roster row even when it was expanded into several grades
+    teacher_codes = data.loc[~data.index.duplicated(), ['School', 'School_ID']].copy()
+    teacher_codes.columns = ['School Name', 'School Code']
+    return teacher_codes
+
+def school_code_sheet_columns(data):
+    # One row per school row with the grouping columns of group_students() (the Student_Ids sheet without Roll_Number)
+    sheet = data[['Grade', 'School', 'School_ID', 'District', 'Block']].reset_index(drop=True)
+    sheet.columns = ['CLASS', 'School Name', 'School Code', 'District Name', 'Block Name']
+    return sheet
+
+@timed_stage('output_sheets', rows=lambda sheets: len(sheets[0]))
+def build_output_sheets(data, data_expanded):
+    return student_sheet(data_expanded), school_code_sheet(data)
+
+class StudentTable:
+    # Compact result of process_data(): the school rows (one per roster row and grade) and where each school's
+    # students start in the student order. Nothing is kept per student: names and IDs are stored once per school,
+    # and the per-student rows (school position, student number) and ID strings are built for the schools asked for
+    # (export, grouping, rendering) and not kept, so the cached result grows with the schools, not the students.
+    # kpis(), school_records(), student_ids() and iter_mapped() stream the same results school by school, so
+    # memory scales with the largest school rather than with the whole roster.
+    def __init__(self, schools, student_digits, selected_param):
+        self.schools = schools
+        self.student_digits = student_digits
+        self.selected_param = selected_param
+        self.counts = school_student_counts(schools)
+        # Students of school row i are rows row_starts[i]..row_starts[i + 1]-1 of the Student_Ids sheet; a school
+        # without students still holds one row
+        self.row_starts = np.concatenate([[0], np.cumsum(np.maximum(self.counts, 1))])
+        self.student_index = None
+        self.templates = None
+
+    def __len__(self):
+        return int(self.row_starts[-1])
+
+    @property
+    def nbytes(self):
+        return int(self.schools.memory_usage(deep=True).sum()) + self.counts.nbytes + self.row_starts.nbytes
+
+    def expanded_frame(self):
+        # Full per-student frame with every roster and ID column, as expand_students() + compose_custom_ids() build it
+        return compose_custom_ids(expand_students(self.schools, self.student_digits), self.selected_param)
+
+    def mapped_frame(self, first=0, last=None):
+        # The Student_Ids sheet (Roll_Number, Grade, School Name, School Code, District Name, Block Name) of the
+        # students of school rows first..last-1 (every school by default), expanding only the columns the sheet and
+        # the Custom_ID need
+        plan = compile_custom_id(self.selected_param)
+        columns = ['Grade', 'School', 'School_ID', 'District', 'Block'] + [column for column in plan if column in self.schools.columns]
+        school_index, student_seq = positions_from_counts(self.counts[first:last])
+        student_rows = self.schools[list(dict.fromkeys(columns))].iloc[first:last].iloc[school_index]
+        if 'Student_IDs' in plan or 'student_no' in plan:
+            student_rows['Student_IDs'], student_rows['student_no'] = student_id_columns(student_rows, student_seq, self.student_digits)
+        return student_sheet(compose_custom_ids(student_rows, self.selected_param))
+
+    def iter_mapped(self, chunk_rows=50000, first=0, end=None):
+        # The Student_Ids sheet of the school rows first..end-1 (all by default) in chunks of whole schools of about
+        # chunk_rows students (at least one school per chunk); concatenated they equal mapped_frame()
+        end = len(self.schools) if end is None else end
+        while True:
+            last = max(int(np.searchsorted(self.row_starts, self.row_starts[first] + chunk_rows, side='right')) - 1, first + 1)
+            last = min(last, end)
+            yield self.mapped_frame(first, last)
+            if last >= end:
+                return
+            first = last
+
+    def teacher_codes(self):
+        # The School_Codes sheet
+        return school_code_sheet(self.schools)
+
+    def kpis(self):
+        # The summary KPIs of group_students() straight from the school rows: one ID per student (a school without
+        # students still holds one) and the distinct school, block and district names
+        return {
+            'Number of Students': len(self),
+            'Number of Schools': self.schools['School'].nunique(),
+            'Number of Blocks': self.schools['Block'].nunique(),
+            'Number of Districts': self.schools['District'].nunique()
+        }
+
+    def id_templates(self):
+        # Custom_ID text of every school row with '\x00' in place of the student_no part and '\x01' in place of the
+        # student number inside Student_IDs, built once so per-school IDs are plain string substitutions.
+        # A school row without students has a single ID without student part.
+        if self.templates is None:
+            rows = self.schools.reset_index(drop=True)
+            self.templates = custom_id_templates(rows, self.selected_param, self.counts > 0).tolist()
+        return self.templates
+
+    def school_ids(self, positions):
+        # Roll_Numbers of the school row positions given, in sheet order
+        templates = self.id_templates()
+        ids = []
+        for position in positions:
+            template = templates[position]
+            count = self.row_starts[position + 1] - self.row_starts[position]
+            if '\x00' not in template and '\x01' not in template:
+                ids.extend([template] * count)
+                continue
+            for number in range(1, count + 1):
+                padded = str(number).zfill(self.student_digits)
+                ids.append(template.replace('\x00', padded[-self.student_digits:]).replace('\x01', padded))
+        return ids
+
+    def distinct_ids(self, positions):
+        # Number of distinct Roll_Numbers of the school row positions given
+        return len(set(self.school_ids(positions)))
+
+    @timed_stage('group_schools', rows=len)
+    def school_records(self):
+        # The records of group_students(self.mapped_frame()), in the same order and with the same values, grouped
+        # from the school rows without building the student frame. The student IDs are not attached; render them
+        # with student_ids=table.student_ids.
+        sheet = school_code_sheet_columns(self.schools)
+        grouping_columns = [col for col in sheet.columns if sheet[col].notna().any()]
+        groups = sheet.groupby(grouping_columns)
+        group_number = groups.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+        # student_count holds the school rows per group until the counts are filled in
+        grouped = groups.size().reset_index(name='student_count')
+        # A single school row holds one distinct ID per student slot as long as the plan ends in the zero-padded
+        # student number; shared groups and other plans are counted exactly from their IDs
+        counts = self.schools['Total_Students_With_Buffer'].fillna(0).clip(lower=0).to_numpy()
+        plan = compile_custom_id(self.selected_param)
+        simple = counts < 10 ** self.student_digits if plan[-1:] in (('student_no',), ('Student_IDs',)) else np.zeros(len(counts), dtype=bool)
+        kept = group_number >= 0
+        student_count = np.bincount(group_number[kept], weights=np.maximum(counts, 1)[kept], minlength=len(grouped))
+        exact = np.bincount(group_number[kept], weights=~simple[kept], minlength=len(grouped)) > 0
+        exact |= grouped['student_count'].to_numpy() > 1
+        if exact.any():
+            members = pd.Series(np.arange(len(sheet))[kept]).groupby(group_number[kept]).apply(list)
+            for number in np.flatnonzero(exact):
+                student_count[number] = self.distinct_ids(members[number])
+        grouped['student_count'] = student_count.astype(np.int64)
+        if 'CLASS' in grouped.columns and grouped['CLASS'].astype(str).str.contains(r'\D').any():
+            grouped['CLASS'] = grouped['CLASS'].astype(str).str.extract(r'(\d+)')
+        return grouped.to_dict(orient='records')
+
+    def record_positions(self, record):
+        # School row positions whose students belong to a grouped record (by School Code and class, like group_students())
+        if self.student_index is None:
+            sheet = school_code_sheet_columns(self.schools)
+            class_keys = sheet['CLASS'].astype(str)
+            if class_keys.str.contains(r'\D').any():
+                class_keys = class_keys.str.extract(r'(\d+)')[0]
+            self.student_index = {key: positions for key, positions in
+                                  pd.Series(np.arange(len(sheet))).groupby([sheet['School Code'], class_keys], sort=False).apply(list).items()}
+        return self.student_index.get((record.get('School Code', ''), str(record.get('CLASS'))), [])
+
+    def student_ids(self, record):
+        # Roll_Numbers of a grouped record, built on demand
+        return np.array(self.school_ids(self.record_positions(record)), dtype=str)
+
+def process_data(uploaded_file, partner_id, buffer_percent, grade, district_digits, block_digits, school_digits, student_digits, selected_param, report=None, registry=None, validate=True):
+    # Read the roster and assign the IDs; returns a StudentTable that formats the student sheets on demand.
+    # Raises IdCapacityError when validate is set and the digits cannot hold the roster (see check_id_capacity()).
+    data = read_roster(uploaded_file, report)
+    data = assign_roster_ids(data, partner_id, buffer_percent, grade, district_digits, block_digits, school_digits, registry)
+    if validate:
+        problems = check_id_capacity(data, district_digits, block_digits, school_digits, student_digits, selected_param)
+        if problems:
+            raise IdCapacityError(problems)
+    # Stage 3: one row per student ID, kept as integer positions
+    return StudentTable(data, student_digits, selected_param)
+
+def find_column(df, variations, label):
+    # Identify the actual column name from the variations
+    for variation in variations:
+        if variation in df.columns:
+            return variation
+    raise ValueError(f"No recognized {label} column found in the data")
+
+@timed_stage('group_students', rows=lambda grouped: len(grouped[1]))
+def group_students(mapped_data):
+    # Stage 5: standardize the mapped sheet, group it per school and compute the summary KPIs
+    # Define possible variations of 'Student ID' and class column names
+    student_id_column = find_column(mapped_data, ['STUDENT ID', 'STUDENT_ID', 'ROLL_NUMBER', 'Roll_Number', 'Roll Number'], 'student ID')
+    class_column = find_column(mapped_data, ['CLASS', 'Class', 'GRADE', 'Grade'], 'class')
+
+    # Standardize column name to 'STUDENT_ID'
+    df = mapped_data.rename(columns={student_id_column: 'STUDENT ID', class_column: 'CLASS'})
+    grouping_columns = [col for col in df.columns if col not in ['STUDENT ID', 'Gender'] and df[col].notna().any()]
+    grouped = df.groupby(grouping_columns).agg(student_count=('STUDENT ID', 'nunique')).reset_index()
+
+    class_keys = df['CLASS'].astype(str)
+    if 'CLASS' in grouped.columns and grouped['CLASS'].astype(str).str.contains(r'\D').any():
+        grouped['CLASS'] = grouped['CLASS'].astype(str).str.extract(r'(\d+)')
+        class_keys = class_keys.str.extract(r'(\d+)')[0]
+
+    result = grouped.to_dict(orient='records')
+
+    # Index the student IDs of every school and grade in one groupby pass so each renderer gets its IDs
+    # directly instead of scanning the whole frame per PDF
+    if 'School Code' in df.columns:
+        # Fixed-width text arrays instead of arrays of Python strings: about half the memory and cheap to send to workers
+        student_index = {key: ids.to_numpy(dtype=str) for key, ids in df['STUDENT ID'].groupby([df['School Code'], class_keys], sort=False)}
+        for record in result:
+            key = (record.get('School Code', ''), str(record.get('CLASS')))
+            record['student_ids'] = student_index.get(key, np.array([], dtype=str))
+
+    # Calculating KPIs
+    kpis = {
+        'Number of Students': len(df['STUDENT ID'].unique()),
+        'Number of Schools': df['School Name'].nunique() if 'School Name' in df.columns else 0,
+        'Number of Blocks': df['Block Name'].nunique() if 'Block Name' in df.columns else 0,
+        'Number of Districts': df['District Name'].nunique() if 'District Name' in df.columns else 0
+    }
+    return df, result, kpis
+
+def match_info_labels(info_values):
+    # Fill the info block labels from the record values whose key shares the label's first 5 characters
+    info_labels = {
+        'DISTRICT': '',
+        'BLOCK': '',
+        'SCHOOL NAME': '',
+        'CLASS': '',
+        'SECTION': ''
+    }
+
+    for label in info_labels.keys():
+        for key, value in info_values.items():
+            if label[:5].lower() == key[:5].lower():  # Match first 5 characters, ignoring case
+                info_labels[label] = value
+                break
+    return info_labels
+
+# Function to create the attendance list PDF
+def create_attendance_pdf(pdf, column_widths, column_names, image_path, info_values, df):
+    pdf.add_page()
+
+    # Set top margin to 25 mm
+    pdf.set_top_margin(20)
+    pdf.set_auto_page_break(auto=True, margin=20)
+
+    # Page width and margins
+    page_width = 210  # A4 page width in mm
+    margin_left = 10
+    margin_right = 10
+    available_width = page_width - margin_left - margin_right
+
+    # Calculate total column width
+    total_column_width = sum(column_widths[col] for col in column_names)
+
+    # Scale column widths if necessary
+    if total_column_width > available_width:
+        scaling_factor = available_width / total_column_width
+        column_widths = {col: width * scaling_factor for col, width in column_widths.items()}
+
+    # Move to 20 mm from the top
+    pdf.set_y(20)
+
+    # Set the Font for the Title and Subtitle
+    pdf.set_font('Arial', 'B', 7)
+
+    # Calculate the Width of the Merged Cell
+    merged_cell_width = sum(column_widths[col] for col in column_names)  # Total width based on scaled column widths
+
+    # Add the Title and Subtitle in the Center
+    pdf.cell(merged_cell_width, 12, '', border='LTR', ln=1, align='C')  # Create an empty cell with borders
+
+    # Set the cursor position back to the beginning of the merged cell
+    pdf.set_xy(pdf.get_x(), pdf.get_y() - 10)
+
+    # Centered Title
+    pdf.cell(merged_cell_width, 4, 'ATTENDANCE LIST', border=0, align='C', ln=2)
+
+    # Centered Subtitle
+    pdf.set_font('Arial', '', 3)
+    pdf.cell(merged_cell_width, 1, '(PLEASE FILL ALL THE DETAILS IN BLOCK LETTERS)', border=0, align='C', ln=1)
+
+    # Bottom border of the merged cell
+    pdf.cell(merged_cell_width, 3, '', border='LBR', ln=1)  # Bottom border of the merged cell
+
+    # Add the image in the top-right corner of the bordered cell
+    place_image(pdf, image_path, x=pdf.get_x() + 153, y=pdf.get_y() - 8, w=15, h=5)  # Adjust position and size as needed
+
+    # Add the additional information cell below the "ATTENDANCE LIST" cell
+    pdf.set_font('Arial', 'B', 5)
+    info_cell_width = merged_cell_width  # Width same as the merged title cell
+    info_cell_height = 15  # Adjust height as needed
+    pdf.cell(info_cell_width, info_cell_height, '', border='LBR', ln=1)
+    pdf.set_xy(pdf.get_x(), pdf.get_y() - info_cell_height)  # Move back to the top of the cell
+
+    # Add labels and fill values from the dictionary
+    info_labels = match_info_labels(info_values)
+
+    # Width for the school name and date of assessment cells
+    school_name_width = info_cell_width * 0.65  # 65% of the total width for the school name
+    date_width = info_cell_width * 0.35         # 35% of the total width for the date of assessment
+
+    # Add the DISTRICT, BLOCK, and other labels
+    pdf.cell(info_cell_width, 3, f"DISTRICT : {info_labels['DISTRICT']}", border='LR', ln=1)
+    pdf.cell(info_cell_width, 3, f"BLOCK : {info_labels['BLOCK']}", border='LR', ln=1)
+
+    # Add the SCHOOL NAME
+    pdf.cell(school_name_width, 3, f"SCHOOL NAME : {info_labels['SCHOOL NAME']}", border='L', ln=0)  # Left border only
+
+    # Set a different font for the DATE OF ASSESSMENT
+    pdf.set_font('Arial', 'B', 4)  # Set to Arial, Italic, size 5
+
+    # Add the DATE OF ASSESSMENT on the right side
+    pdf.cell(date_width, 3, "DATE OF ASSESSMENT : ______________            ", border='R', ln=1, align='R')  # Right border only
+
+    # Reset the font back to the original for the remaining labels
+    pdf.set_font('Arial', 'B', 5)
+
+    # Add the CLASS and SECTION labels
+    pdf.cell(info_cell_width, 3, f"CLASS : {info_labels['CLASS']}", border='LR', ln=1)
+    pdf.cell(info_cell_width, 3, f"SECTION : {info_labels['SECTION']}", border='LR', ln=1)
+
+    # Draw a border around the table header
+    pdf.set_font('Arial', 'B', 5)
+    table_cell_height = 9
+
+    # Add the Title and Subtitle in the Center
+
+    pdf.cell(6, 4,'', border='LTR', align='C')
+    pdf.cell(15,4,'', border='LTR', align='C')
+    pdf.cell(60,4, '', border='LTR', align='C')
+    pdf.cell(10,4, '', border='LTR', align='C')
+    pdf.cell(10,4, '', border='LTR', align='C')
+    pdf.cell(23,4, '', border='LTR', align='C')
+    pdf.cell(24,4, '', border='LTR', align='C')
+    pdf.cell(24,4, '', border='LTR', align='C')  # End of the row
+
+    pdf.ln(4)
+    # First row of headers
+    pdf.cell(6, 0.5, 'S.NO', border='LR', align='C')
+    pdf.cell(15,0.5, 'STUDENT ID', border='LR', align='C')
+    pdf.cell(60,0.5, 'STUDENT NAME', border='LR', align='C')
+    pdf.cell(10,0.5, 'GENDER', border='LR', align='C')
+    pdf.cell(10,0.5, 'TAB ID', border='LR', align='C')
+    pdf.cell(23,0.5, 'SESSION', border='LR', align='C')
+    pdf.cell(24,0.5, 'SUBJECT 1', border='LR', align='C')
+    pdf.cell(24,0.5, 'SUBJECT 2', border='LR', align='C')  # End of the row
+
+    # Move to the next line
+    pdf.ln(0.5)
+
+    # Second row of headers (merged cells)
+    pdf.set_font("Arial", size=5)
+    pdf.cell(6, 4.5, '', border='LBR', align='C')  # Empty cell under S.NO
+    pdf.cell(15, 4.5, '', border='LBR', align='C')  # Empty cell under STUDENT ID
+    pdf.cell(60, 4.5, '', border='LBR', align='C')  # Empty cell under STUDENT NAME
+    pdf.cell(10, 4.5, '', border='LBR', align='C')  # Empty cell under GENDER
+    pdf.cell(10, 4.5, '', border='LBR', align='C')  # Empty cell under TAB ID
+    pdf.cell(23, 4.5, '(morning/afternoon)', border='LBR', align='C')  # SESSION description
+    pdf.cell(24, 4.5, 'Present/Absent', border='LBR', align='C')  # SUBJECT 1 details
+    pdf.cell(24, 4.5, 'Present/Absent', border='LBR', align='C')  # SUBJECT 2 details
+
+    pdf.ln(4.5)
+
+    # Table Rows (based on student_count)
+    pdf.set_font('Arial', '', 6)
+    student_count = info_values.get('student_count', 0)  # Use 0 if 'student_count' is missing or not found
+
+    # Fill in the student IDs for the selected school code, using the index built by group_students() when present
+    student_ids = info_values.get('student_ids')
+    if student_ids is None:
+        student_ids = df[df['School Code'] == info_values.get('School Code', '')]['STUDENT ID'].tolist()
+
+    for i in range(student_count):
+        # Fill in S.NO column
+        pdf.cell(column_widths['S.NO'], table_cell_height, str(i + 1), border=1, align='C')
+
+        # Fill in STUDENT ID column
+        student_id = student_ids[i]
+        pdf.cell(column_widths['STUDENT ID'], table_cell_height, str(student_id), border=1, align='C')
+
+        # Fill in remaining columns with empty values
+        for col_name in column_names[2:]:  # Skip first two columns
+            pdf.cell(column_widths[col_name], table_cell_height, '', border=1, align='C')
+
+        pdf.ln(table_cell_height)
+
+def pdf_file_name(record, filename_template):
+    # Resolve the district folder and file name of one grouped record from a naming_options template
+    school_name = record.get('School Name', 'default_school')
+    district_name = record.get('District Name', 'default_district')
+    block_name = record.get('Block Name', 'default_block')
+    grade = record.get('CLASS', 'default_grade')
+    file_name = filename_template.format(school_name=school_name, district_name=district_name, block_name=block_name, grade=grade)
+    return district_name, file_name
+
+class OutputBuffer:
+    # Append-only stand-in for the str fpdf 1.x writes a document into. fpdf grows it with buffer += line, which
+    # copies the whole file for every line and becomes quadratic for files of a few hundred pages.
+    def __init__(self):
+        self.parts = []
+        self.length = 0
+
+    def __iadd__(self, text):
+        self.parts.append(text)
+        self.length += len(text)
+        return self
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return ''.join(self.parts)
+
+@lru_cache(maxsize=None)
+def attendance_document_class():
+    # FPDF with a flat document outline (bookmarks), which fpdf 1.x cannot write by itself. Built on first use so the
+    # app starts without loading the PDF library. A document without bookmarks is written exactly as FPDF writes it.
+    from fpdf import FPDF
+
+    class AttendanceDocument(FPDF):
+        def __init__(self, *args, **kwargs):
+            FPDF.__init__(self, *args, **kwargs)
+            self.outlines = []
+            self.outline_root = None
+
+        def bookmark(self, title, page=None, y=0):
+            # Outline entry pointing at y (mm) on page (the current page by default)
+            self.outlines.append((title, page or self.page, y))
+
+        def _enddoc(self):
+            self.buffer = OutputBuffer()
+            FPDF._enddoc(self)
+            self.buffer = str(self.buffer)
+
+        def _putresources(self):
+            FPDF._putresources(self)
+            if self.outlines:
+                self._putoutlines()
+
+        def _putoutlines(self):
+            # One outline item object per bookmark followed by the outline root; page n is object 1 + 2n
+            first = self.n + 1
+            count = len(self.outlines)
+            for index, (title, page, y) in enumerate(self.outlines):
+                self._newobj()
+                self._out('<</Title ' + self._textstring(title))
+                self._out('/Parent %d 0 R' % (first + count))
+                if index > 0:
+                    self._out('/Prev %d 0 R' % (first + index - 1))
+                if index < count - 1:
+                    self._out('/Next %d 0 R' % (first + index + 1))
+                self._out('/Dest [%d 0 R /XYZ 0 %.2f null]>>' % (1 + 2 * page, (self.h - y) * self.k))
+                self._out('endobj')
+            self._newobj()
+            self._out('<</Type /Outlines /First %d 0 R /Last %d 0 R /Count %d>>' % (first, first + count - 1, count))
+            self._out('endobj')
+            self.outline_root = self.n
+
+        def _putcatalog(self):
+            FPDF._putcatalog(self)
+            if self.outline_root is not None:
+                self._out('/Outlines %d 0 R' % self.outline_root)
+                self._out('/PageMode /UseOutlines')
+
+    return AttendanceDocument
+
+def new_attendance_document():
+    pdf = attendance_document_class()(orientation='P', unit='mm', format='A4')
+    pdf.set_left_margin(18)
+    pdf.set_right_margin(18)
+    return pdf
+
+class AttendanceSheetTemplate:
+    # Invariant parts of an attendance sheet built once and replayed for every school.
+    # create_attendance_pdf() draws the title box, info block and header grid a single time with placeholder
+    # info values; each sheet copies that page and stamps only the district/block/school/class values, and the
+    # table rows reuse cached border cells per row position so only S.NO and the student ID are laid out.
+    # The output is byte-for-byte what create_attendance_pdf() produces. Needs fpdf 1.x, which keeps page
+    # content as text in pdf.pages; supported() is False otherwise and callers draw every cell instead.
+    placeholders = {label: f'\x00{label}\x00' for label in ['DISTRICT', 'BLOCK', 'SCHOOL NAME', 'CLASS', 'SECTION']}
+    table_cell_height = 9
+
+    def __init__(self, column_widths, column_names, image_path):
+        self.prototype = new_attendance_document()
+        create_attendance_pdf(self.prototype, column_widths, column_names, image_path, dict(self.placeholders, student_count=0, student_ids=[]), None)
+        self.skeleton = self.prototype.pages.get(1)
+        # Same scaling as create_attendance_pdf()
+        available_width = 210 - 10 - 10
+        total_column_width = sum(column_widths[col] for col in column_names)
+        if total_column_width > available_width:
+            scaling_factor = available_width / total_column_width
+            column_widths = {col: width * scaling_factor for col, width in column_widths.items()}
+        self.widths = [column_widths[col] for col in column_names]
+        self.row_cells = {}
+
+    def supported(self):
+        return isinstance(self.skeleton, str)
+
+    def render(self, info_values, df=None):
+        pdf = copy.copy(self.prototype)
+        # Give the copy its own mutable document state; fonts and images are annotated while writing the file
+        pdf.fonts = {key: dict(font) for key, font in self.prototype.fonts.items()}
+        pdf.current_font = next(pdf.fonts[key] for key, font in self.prototype.fonts.items() if font is self.prototype.current_font)
+        pdf.images = {key: dict(info) for key, info in self.prototype.images.items()}
+        pdf.offsets, pdf.links, pdf.page_links, pdf.orientation_changes = {}, {}, {}, {}
+
+        page = self.skeleton
+        for label, value in match_info_labels(info_values).items():
+            page = page.replace(self.placeholders[label], pdf._escape(f"{value}"))
+        pdf.pages = {1: page}
+
+        student_count = info_values.get('student_count', 0)
+        student_ids = info_values.get('student_ids')
+        if student_ids is None:
+            student_ids = df[df['School Code'] == info_values.get('School Code', '')]['STUDENT ID'].tolist()
+        for i in range(student_count):
+            if pdf.y + self.table_cell_height > pdf.page_break_trigger:
+                # Automatic page break, as pdf.cell() would do
+                x = pdf.x
+                pdf.add_page(pdf.cur_orientation)
+                pdf.x = x
+            sno_cell, id_cell, empty_cells = self.cells_for_row(pdf.x, pdf.y)
+            pdf._out(sno_cell + self.centered_text(pdf, pdf.x, pdf.y, self.widths[0], str(i + 1)))
+            pdf._out(id_cell + self.centered_text(pdf, pdf.x + self.widths[0], pdf.y, self.widths[1], str(student_ids[i])))
+            pdf.pages[pdf.page] += empty_cells
+            pdf.lasth = self.table_cell_height
+            pdf.ln(self.table_cell_height)
+        return pdf
+
+    def cells_for_row(self, x, y):
+        # Border-only cell operators of one table row, formatted the way pdf.cell() does and cached per position
+        if (x, y) not in self.row_cells:
+            k, h = self.prototype.k, self.table_cell_height
+            cells = []
+            cell_x = x
+            for width in self.widths:
+                cells.append('%.2f %.2f %.2f %.2f re S ' % (cell_x * k, (self.prototype.h - y) * k, width * k, -h * k))
+                cell_x += width
+            self.row_cells[(x, y)] = (cells[0], cells[1], ''.join(cell + '\n' for cell in cells[2:]))
+        return self.row_cells[(x, y)]
+
+    def centered_text(self, pdf, x, y, width, text):
+        dx = (width - pdf.get_string_width(text)) / 2.0
+        return 'BT %.2f %.2f Td (%s) Tj ET' % ((x + dx) * pdf.k, (pdf.h - (y + .5 * self.table_cell_height + .3 * pdf.font_size)) * pdf.k, pdf._escape(text))
+
+# Templates built so far in this process, keyed by logo
+attendance_templates = {}
+
+def attendance_template(image_path):
+    if image_path not in attendance_templates:
+        attendance_templates[image_path] = AttendanceSheetTemplate(column_widths, column_names, image_path)
+    return attendance_templates[image_path]
+
+def render_attendance_pdf(record, df, image_path=image_path, template=False):
+    # Build the attendance sheet of a single grouped record, stamping it on the cached page template when asked
+    if template and attendance_template(image_path).supported():
+        return attendance_template(image_path).render(record, df)
+    pdf = new_attendance_document()
+    create_attendance_pdf(pdf, column_widths, column_names, image_path, record, df)
+    return pdf
+
+# Frame and logo shared by the PDF worker processes, set once per worker by init_render_worker()
+worker_state = {}
+
+# Archives above this size are spooled to disk instead of being kept in memory
+zip_spool_threshold = 256 * 1024 * 1024
+
+def worker_context():
+    # Start method of the worker pools: forkserver (spawn where unavailable), never a plain fork, since the pools are
+    # also started from job threads of the multi-threaded app server, where a forked child can deadlock on a lock
+    # another thread held. The workers get everything they need through the pool's initargs.
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+def init_render_worker(df, image_path, images, template):
+    worker_state['df'] = df
+    worker_state['image_path'] = image_path
+    worker_state['template'] = template
+    # Reuse the logo decoded by the parent process instead of fetching and decoding it again
+    decoded_images.update(images)
+
+def pdf_bytes(pdf):
+    # fpdf 1.x returns the document as a latin-1 str, fpdf2 as a bytearray
+    data = pdf.output(dest='S')
+    return data.encode('latin-1') if isinstance(data, str) else bytes(data)
+
+def render_pdf_bytes(record, df=None, image_path=None, template=False):
+    # Render one record in memory and return (pdf bytes, None), or (None, error message) instead of raising,
+    # so one bad school never aborts the rest of the batch
+    try:
+        if image_path is None:
+            df, image_path, template = worker_state['df'], worker_state['image_path'], worker_state['template']
+        return pdf_bytes(render_attendance_pdf(record, df, image_path, template)), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+def with_student_ids(record, student_ids):
+    # record with its student IDs attached by the student_ids(record) callable, when it does not carry them yet
+    if student_ids is None or 'student_ids' in record:
+        return record
+    return dict(record, student_ids=student_ids(record))
+
+def pdf_tasks(result, filename_template, grade_folders=None):
+    # (arcname, record) pairs in record order, with arcname <district>/<file_name>.pdf, or
+    # Grade <n>/<district>/<file_name>.pdf when grade_folders is set (by default when the records span several grades).
+    # A later school with the same file name replaces the earlier one, as it did when files were written to disk.
+    if grade_folders is None:
+        grade_folders = len({str(record.get('CLASS')) for record in result}) > 1
+    tasks = {}
+    for record in result:
+        district_name, file_name = pdf_file_name(record, filename_template)
+        arcname = f'{district_name}/{file_name}.pdf'
+        if grade_folders:
+            arcname = f"Grade {record.get('CLASS')}/{arcname}"
+        tasks.pop(arcname, None)
+        tasks[arcname] = record
+    return list(tasks.items())
+
+@timed_iterator('render_pdfs')
+def render_pdfs(result, df, filename_template, image_path=image_path, workers=1, progress=None, template=True, grade_folders=None,
+                student_ids=None):
+    # Stage 6: render every grouped record and yield (arcname, pdf bytes, error) in record order (see pdf_tasks()).
+    # With workers > 1 the records are spread over a process pool with a bounded number of PDFs in flight,
+    # so memory does not grow with the number of schools; progress(done, total) is called after each record.
+    # template stamps each sheet on the cached page skeleton (AttendanceSheetTemplate) instead of drawing every cell.
+    # student_ids(record) supplies the IDs of records without them (see StudentTable.student_ids()) just before the
+    # record is rendered, so only the schools in flight hold their IDs.
+    tasks = pdf_tasks(result, filename_template, grade_folders)
+    # Records indexed by group_students() carry their own student IDs, so the frame only goes to the workers when needed
+    worker_df = df if student_ids is None and any('student_ids' not in record for record in result) else None
+    yield from render_tasks(tasks, render_pdf_bytes, lambda record: with_student_ids(record, student_ids), df, worker_df,
+                            image_path, workers, progress, template)
+
+def render_tasks(tasks, render, prepare, df, worker_df, image_path, workers, progress, template):
+    # Run render(prepare(payload), ...) for every (arcname, payload) task, in this process or on a process pool with a
+    # bounded number of tasks in flight, and yield (arcname, pdf bytes, error) in task order.
+    # render is render_pdf_bytes() or render_bundle_bytes(); the workers get worker_df, the logo and template once.
+    total = len(tasks)
+    # Resolve and decode the logo once up front; a missing logo fails the run here instead of in every PDF
+    load_image(image_path)
+    if workers <= 1 or total <= 1:
+        for index, (arcname, payload) in enumerate(tasks):
+            rendered, error = render(prepare(payload), df, image_path, template)
+            if progress:
+                progress(index + 1, total)
+            yield arcname, rendered, error
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context(), initializer=init_render_worker,
+                             initargs=(worker_df, image_path, {image_path: decoded_images[image_path]}, template)) as executor:
+        remaining = iter(tasks)
+        pending = deque((arcname, executor.submit(render, prepare(payload))) for arcname, payload in islice(remaining, workers * 4))
+        done = 0
+        while pending:
+            arcname, future = pending.popleft()
+            try:
+                rendered, error = future.result()
+            except Exception as e:  # e.g. a worker process died
+                rendered, error = None, f"{type(e).__name__}: {e}"
+            for next_arcname, payload in islice(remaining, 1):
+                pending.append((next_arcname, executor.submit(render, prepare(payload))))
+            done += 1
+            if progress:
+                progress(done, total)
+            yield arcname, rendered, error
+
+def bundle_tasks(result, filename_template, level='district', grade_folders=None):
+    # (arcname, [(bookmark title, record), ...]) per district (<district>.pdf) or block (<district>/<block>.pdf) in
+    # order of first appearance, under Grade <n>/ when grade_folders is set (by default when the records span several
+    # grades). Bookmarks are named like the per-school files; schools that would share a file name all stay in.
+    if level not in ('district', 'block'):
+        raise ValueError(f"Unsupported bundle level: {level}")
+    if grade_folders is None:
+        grade_folders = len({str(record.get('CLASS')) for record in result}) > 1
+    bundles = {}
+    for record in result:
+        district_name, file_name = pdf_file_name(record, filename_template)
+        arcname = f'{district_name}.pdf' if level == 'district' else f"{district_name}/{record.get('Block Name', 'default_block')}.pdf"
+        if grade_folders:
+            arcname = f"Grade {record.get('CLASS')}/{arcname}"
+        bundles.setdefault(arcname, []).append((file_name, record))
+    return list(bundles.items())
+
+def append_pages(document, pdf):
+    # Move the pages of pdf to the end of document. Sheets drawn by the same code register the same fonts and logo
+    # under the same resource names, so the pages are copied as they are and every resource is stored once per file.
+    for resources, added in ((document.fonts, pdf.fonts), (document.images, pdf.images)):
+        for key, resource in added.items():
+            if key not in resources and resource['i'] not in {known['i'] for known in resources.values()}:
+                resources[key] = resource
+            elif resources.get(key, {}).get('i') != resource['i']:
+                raise ValueError("Sheets use different fonts or images and cannot share one file")
+    for page in range(1, pdf.page + 1):
+        document.page += 1
+        document.pages[document.page] = pdf.pages[page]
+        if page in pdf.orientation_changes:
+            document.orientation_changes[document.page] = True
+
+def render_bundle_bytes(entries, df=None, image_path=None, template=False):
+    # Render the sheets of (bookmark title, record) entries into one document with a bookmark at each school's
+    # first page; returns (pdf bytes, None) or (None, error message) like render_pdf_bytes()
+    try:
+        if image_path is None:
+            df, image_path, template = worker_state['df'], worker_state['image_path'], worker_state['template']
+        document = None
+        for title, record in entries:
+            pdf = render_attendance_pdf(record, df, image_path, template)
+            if document is None:
+                document = pdf
+                document.outlines = []
+                first_page = 1
+            else:
+                first_page = document.page + 1
+                append_pages(document, pdf)
+            document.bookmark(title, first_page)
+        return pdf_bytes(document), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+@timed_iterator('render_bundles')
+def render_bundles(result, df, filename_template, level='district', image_path=image_path, workers=1, progress=None, template=True,
+                   grade_folders=None, student_ids=None):
+    # Like render_pdfs(), but yields one multi-page PDF per district or block (see bundle_tasks()) with a bookmark per
+    # school; progress counts files
+    tasks = bundle_tasks(result, filename_template, level, grade_folders)
+    worker_df = df if student_ids is None and any('student_ids' not in record for record in result) else None
+    yield from render_tasks(tasks, render_bundle_bytes, lambda entries: [(title, with_student_ids(record, student_ids)) for title, record in entries],
+                            df, worker_df, image_path, workers, progress, template)
+
+def pdf_content_hash(record, image_path):
+    # Hash of everything drawn on a sheet: the grouped record, its student IDs and the logo
+    values = {key: value for key, value in record.items() if key != 'student_ids'}
+    student_ids = record.get('student_ids')
+    payload = json.dumps([values, None if student_ids is None else [str(student_id) for student_id in student_ids], image_path],
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def render_changed_pdfs(result, df, filename_template, registry, scope, previous_zip=None, image_path=image_path, workers=1,
+                        progress=None, template=True, report=None, student_ids=None, manifest=None):
+    # Like render_pdfs(), but only sheets whose content hash differs from the registry manifest of scope are
+    # rendered; unchanged sheets are copied from previous_zip (the archive written by the last run).
+    # manifest (a dict) is filled with the hash of every sheet yielded; the caller saves it with
+    # registry.save_manifest() once the new archive is in place. report gets the rendered/reused counts.
+    grade_folders = len({str(record.get('CLASS')) for record in result}) > 1
+    tasks = dict(pdf_tasks(result, filename_template, grade_folders))
+    hashes = {arcname: pdf_content_hash(with_student_ids(record, student_ids), image_path) for arcname, record in tasks.items()}
+    known = registry.manifest(scope)
+    previous = None
+    if previous_zip and os.path.exists(previous_zip):
+        try:
+            previous = zipfile.ZipFile(previous_zip)
+        except (zipfile.BadZipFile, OSError) as e:
+            # e.g. left truncated by an interrupted run: render every sheet again rather than fail every later run
+            logger.warning(f"Previous archive {previous_zip} is unreadable ({e}); re-rendering every sheet")
+    previous_names = set(previous.namelist()) if previous else set()
+    changed = [arcname for arcname in tasks if known.get(arcname) != hashes[arcname] or arcname not in previous_names]
+    rendered = render_pdfs([tasks[arcname] for arcname in changed], df, filename_template, image_path, workers, progress, template, grade_folders,
+                           student_ids)
+    changed = set(changed)
+    written = {} if manifest is None else manifest
+    try:
+        for arcname in tasks:
+            if arcname in changed:
+                arcname, data, error = next(rendered)
+            else:
+                data, error = previous.read(arcname), None
+            if error is None:
+                written[arcname] = hashes[arcname]
+            yield arcname, data, error
+    finally:
+        if previous:
+            previous.close()
+    if report is not None:
+        report.update({'rendered_pdfs': len(changed), 'reused_pdfs': len(tasks) - len(changed)})
+
+def find_schools(records, query):
+    # Grouped records of the schools whose School Code equals query or whose name contains it (ignoring case)
+    query = str(query).strip()
+    if not query:
+        return []
+    by_code = [record for record in records if str(record.get('School Code', '')) == query]
+    if by_code:
+        return by_code
+    return [record for record in records if query.casefold() in str(record.get('School Name', '')).casefold()]
+
+@timed_stage('render_school')
+def render_school_pdf(record, filename_template, image_path=image_path, template=True, student_ids=None):
+    # Render the sheet of one grouped record on its own, exactly as it appears in the zip; returns (file name, pdf bytes).
+    # Raises ValueError when the sheet cannot be rendered, including when the logo cannot be loaded.
+    _, file_name = pdf_file_name(record, filename_template)
+    try:
+        load_image(image_path)
+    except (OSError, RuntimeError, ValueError) as e:  # a missing logo file, an unreachable URL or an image fpdf cannot read
+        raise ValueError(f"Could not render {file_name}.pdf: the logo {image_path} cannot be loaded ({e})") from e
+    rendered, error = render_pdf_bytes(with_student_ids(record, student_ids), None, image_path, template)
+    if error is not None:
+        raise ValueError(f"Could not render {file_name}.pdf: {error}")
+    return f'{file_name}.pdf', rendered
+
+@timed_stage('package_zip', rows=lambda packaged: len(packaged[1]))
+def package_zip(rendered, target=None, spool_threshold=zip_spool_threshold):
+    # Stage 7: write each rendered PDF straight into its zip entry, keeping the district folder layout.
+    # The archive goes to the target path, or to a spooled temporary file that stays in memory below
+    # spool_threshold and moves to disk above it. Returns the rewound archive file (the caller closes it),
+    # the entry names written and a list of (file_name, error) for the PDFs that failed.
+    zip_target = open(target, 'w+b') if target else tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+    written = []
+    failures = []
+    try:
+        with zipfile.ZipFile(zip_target, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for arcname, data, error in rendered:
+                if error is None:
+                    zip_file.writestr(arcname, data)
+                    written.append(arcname)
+                else:
+                    failures.append((arcname.rsplit('/', 1)[-1], error))
+    except BaseException:
+        # e.g. a cancelled job stopping the render loop: release the half-written archive
+        zip_target.close()
+        raise
+    zip_target.seek(0)  # Reset buffer position
+    return zip_target, written, failures
+
+def run_pipeline(source, output_dir, partner_id=1, buffer_percent=0.0, grade=1, district_digits=2, block_digits=2,
+                 school_digits=4, student_digits=3, selected_param='A4', naming='School Name + District Name', image_path=None,
+                 workers=1, progress=None, template=True, report=None, export_format='xlsx', registry=None, validate=True, bundle=None):
+    # Run every stage end to end and write Student_Ids, School_Codes (in export_format) and attendance_Sheets.zip to output_dir.
+    # With an IdRegistry, IDs stay stable across runs and only the sheets that changed since the last run are re-rendered.
+    # bundle ('district' or 'block') writes one bookmarked multi-page PDF per district or block instead of one per school.
+    os.makedirs(output_dir, exist_ok=True)
+    image_path = image_path or logo_for_partner(partner_id)
+    table = process_data(
+        source, partner_id, buffer_percent, grade, district_digits, block_digits, school_digits, student_digits, selected_param, report, registry, validate
+    )
+    extension = export_formats[export_format][0]
+    outputs = {
+        'student_ids': os.path.join(output_dir, f'Student_Ids{extension}'),
+        'school_codes': os.path.join(output_dir, f'School_Codes{extension}'),
+        'zip': os.path.join(output_dir, 'attendance_Sheets.zip')
+    }
+    # The student sheet and the PDFs are produced school by school; the per-student frame is never built whole
+    write_export(table.iter_mapped(), outputs['student_ids'], export_format)
+    write_export(table.teacher_codes(), outputs['school_codes'], export_format)
+    result, kpis = table.school_records(), table.kpis()
+    # The archive is written under a temporary name and moved into place once complete, so an interrupted or failed
+    # run leaves the last good archive (which the registry branch copies unchanged sheets from) untouched
+    partial_zip = outputs['zip'] + '.partial'
+    if bundle is not None:
+        rendered = render_bundles(result, None, naming_options[naming], bundle, image_path, workers, progress, template, student_ids=table.student_ids)
+    elif registry is None:
+        rendered = render_pdfs(result, None, naming_options[naming], image_path, workers, progress, template, student_ids=table.student_ids)
+    else:
+        # Unchanged sheets are copied from the last archive
+        previous_zip = outputs['zip'] if zipfile.is_zipfile(outputs['zip']) else None
+        if previous_zip is None and os.path.exists(outputs['zip']):
+            logger.warning(f"Previous archive {outputs['zip']} is unreadable; re-rendering every sheet")
+        manifest = {}
+        rendered = render_changed_pdfs(result, None, naming_options[naming], registry, os.path.abspath(outputs['zip']), previous_zip,
+                                       image_path, workers, progress, template, report, table.student_ids, manifest)
+    try:
+        zip_file, _, failures = package_zip(rendered, partial_zip)
+        zip_file.close()
+        os.replace(partial_zip, outputs['zip'])
+    except BaseException:
+        if os.path.exists(partial_zip):
+            os.remove(partial_zip)
+        raise
+    if registry is not None and bundle is None:
+        # Only now do the hashes describe the archive on disk; saved earlier, a failed close or replace would leave
+        # the old archive with the new hashes and later runs would copy stale sheets from it
+        registry.save_manifest(os.path.abspath(outputs['zip']), manifest)
+    return outputs, kpis, failures
+
+def run_school_pdfs(source, output_dir, query, partner_id=1, buffer_percent=0.0, grade=1, district_digits=2, block_digits=2,
+                    school_digits=4, student_digits=3, selected_param='A4', naming='School Name + District Name', image_path=None,
+                    template=True, report=None, registry=None, validate=True):
+    # Render only the sheets of the schools matching query (see find_schools()) into output_dir; returns their paths
+    os.makedirs(output_dir, exist_ok=True)
+    image_path = image_path or logo_for_partner(partner_id)
+    table = process_data(
+        source, partner_id, buffer_percent, grade, district_digits, block_digits, school_digits, student_digits, selected_param, report, registry, validate
+    )
+    paths = []
+    for record in find_schools(table.school_records(), query):
+        file_name, data = render_school_pdf(record, naming_options[naming], image_path, template, table.student_ids)
+        path = os.path.join(output_dir, file_name)
+        with open(path, 'wb') as pdf_file:
+            pdf_file.write(data)
+        paths.append(path)
+    return paths
+
+def add_run_arguments(parser):
+    # ID, naming and output options shared by this CLI and sharding.py
+    parser.add_argument('--partner-id', type=int, default=1)
+    parser.add_argument('--buffer-percent', type=float, default=0.0)
+    parser.add_argument('--grade', type=int, default=1)
+    parser.add_argument('--district-digits', type=int, default=2)
+    parser.add_argument('--block-digits', type=int, default=2)
+    parser.add_argument('--school-digits', type=int, default=4)
+    parser.add_argument('--student-digits', type=int, default=3)
+    parser.add_argument('--param', default='A4', choices=list(parameter_mapping), help="Parameter set for the Custom_ID")
+    parser.add_argument('--naming', default='School Name + District Name', choices=list(naming_options), help="File naming format")
+    parser.add_argument('--image-path', help="Logo placed on every attendance sheet (local path or URL); defaults to the partner's logo")
+    parser.add_argument('--export-format', default='xlsx', choices=list(export_formats), help="Format of the Student_Ids and School_Codes files")
+    parser.add_argument('--no-template', dest='template', action='store_false', help="Draw every cell of every sheet instead of reusing the cached page template")
+    parser.add_argument('--registry', help="SQLite ID registry; keeps IDs stable across runs and re-renders only changed sheets")
+    parser.add_argument('--no-validate', dest='validate', action='store_false', help="Generate even when the digits cannot hold the roster or Custom_IDs collide")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate student IDs and attendance sheets from a roster file.")
+    parser.add_argument('roster', help="Roster file (.xlsx, .csv or .parquet) with District, Block, School_ID, School and Total_Students columns")
+    parser.add_argument('-o', '--output-dir', default='output', help="Directory for the generated files")
+    add_run_arguments(parser)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Worker processes used to render the PDFs")
+    parser.add_argument('--bundle', choices=['district', 'block'], help="Write one multi-page PDF per district or block, with a bookmark per school, instead of one PDF per school")
+    parser.add_argument('--school', help="Only render the sheets of the schools with this School Code or with this text in their name")
+    parser.add_argument('--profile', action='store_true', help="Log per-stage timing and memory as JSON lines on stderr and print a summary")
+    args = parser.parse_args(argv)
+    load_report = {}
+    recorder = None
+    if args.profile:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        recorder = StageRecorder()
+
+    kpis, failures = {}, []
+    try:
+        with recording(recorder):
+            if args.school:
+                paths = run_school_pdfs(
+                    args.roster, args.output_dir, args.school, args.partner_id, args.buffer_percent, args.grade, args.district_digits,
+                    args.block_digits, args.school_digits, args.student_digits, args.param, args.naming, args.image_path,
+                    args.template, load_report, IdRegistry(args.registry) if args.registry else None, args.validate
+                )
+                outputs = {os.path.basename(path): path for path in paths}
+            else:
+                outputs, kpis, failures = run_pipeline(
+                    args.roster, args.output_dir, args.partner_id, args.buffer_percent, args.grade, args.district_digits,
+                    args.block_digits, args.school_digits, args.student_digits, args.param, args.naming, args.image_path,
+                    args.workers, lambda done, total: print(f"\rRendered {done}/{total} PDFs", end='\n' if done == total else '', flush=True),
+                    args.template, load_report, args.export_format, IdRegistry(args.registry) if args.registry else None, args.validate,
+                    args.bundle
+                )
+    except IdCapacityError as e:
+        parser.exit(2, f"{e}\nUse --no-validate to generate anyway.\n")
+    except (OSError, ValueError) as e:  # e.g. a logo that cannot be found or rendered
+        parser.exit(1, f"{e}\n")
+    if args.school and not outputs:
+        parser.exit(1, f"No school code or name matches {args.school!r}\n")
+    print(f"Loaded {load_report['rows']} roster rows from {load_report['format']} ({load_report['engine']}) in {load_report['seconds']:.2f}s")
+    if 'rendered_pdfs' in load_report:
+        print(f"Re-rendered {load_report['rendered_pdfs']} changed sheets, reused {load_report['reused_pdfs']} unchanged")
+    for name, value in kpis.items():
+        print(f"{name}: {value}")
+    for file_name, error in failures:
+        print(f"Failed to render {file_name}: {error}")
+    for path in outputs.values():
+        print(f"Wrote {path}")
+    if recorder:
+        for record in recorder.records:
+            rows = '' if record['rows'] is None else f", {record['rows']} rows"
+            print(f"{record['stage']}: {record['seconds']:.3f}s wall, {record['cpu_seconds']:.3f}s CPU{rows}")
+        print(f"Total: {recorder.total_seconds():.3f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# Size-bounded LRU cache with expiry for generated results, shared by every session of the server process.
+# Entries are keyed on the roster content hash plus the ID parameters, so an identical regeneration (or a
+# Streamlit rerun caused by an unrelated widget) reuses the frames instead of recomputing them.
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+def roster_hash(source):
+    # SHA-256 of the roster content: an uploaded file object, a binary buffer or a local path
+    digest = hashlib.sha256()
+    if hasattr(source, 'getvalue'):
+        digest.update(source.getvalue())
+    elif hasattr(source, 'read'):
+        position = source.tell()
+        digest.update(source.read())
+        source.seek(position)
+    else:
+        with open(source, 'rb') as roster_file:
+            for block in iter(lambda: roster_file.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def estimate_size(value):
+    # Approximate memory held by a cached value, counting frames with their string contents
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, 'nbytes'):
+        # numpy arrays and compact results such as pipeline.StudentTable
+        return int(value.nbytes)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value.values())
+    return sys.getsizeof(value)
+
+class ResultCache:
+    def __init__(self, max_bytes, max_entries=64, ttl_seconds=3600):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # key -> (value, size, expires_at), least recently used first
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[2] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = estimate_size(value)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            # Values larger than the whole budget are returned to the caller but never cached
+            if size > self.max_bytes:
+                return value
+            self.entries[key] = (value, size, time.monotonic() + self.ttl_seconds)
+            self.total_bytes += size
+            self._evict()
+        return value
+
+    def get_or_compute(self, key, compute):
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = self.put(key, compute())
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total_bytes, 'hits': self.hits, 'misses': self.misses}
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def _evict(self):
+        # Drop expired entries first, then the least recently used ones until both limits hold
+        now = time.monotonic()
+        for key in [key for key, (_, _, expires_at) in self.entries.items() if expires_at < now]:
+            self._remove(key)
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+
+# Process-wide cache; the limits can be tuned per deployment through the environment
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get('ATTENDANCE_CACHE_MB', 1024)) * 1024 * 1024,
+    max_entries=int(os.environ.get('ATTENDANCE_CACHE_ENTRIES', 64)),
+    ttl_seconds=int(os.environ.get('ATTENDANCE_CACHE_TTL', 3600))
+)
+
+# Rendered single-school sheets (PDF bytes), kept apart so reprints never evict generated results and vice versa
+pdf_cache = ResultCache(
+    max_bytes=int(os.environ.get('ATTENDANCE_PDF_CACHE_MB', 64)) * 1024 * 1024,
+    max_entries=int(os.environ.get('ATTENDANCE_PDF_CACHE_ENTRIES', 1024)),
+    ttl_seconds=int(os.environ.get('ATTENDANCE_CACHE_TTL', 3600))
+)
@@ -0,0 +1,130 @@
+# Disk-backed store of generated results, shared by every session and worker of the server and kept across restarts.
+# Each run (keyed on the roster content hash plus the ID parameters, like result_cache) is written once under
+# ATTENDANCE_STORE_DIR/<run id>/: the school rows as memory-mapped Parquet (nothing per student is stored), plus the
+# export files built from them. Sessions and jobs keep only the run key and
+# re-open the run from disk, so no session holds its own copy. Runs used least recently are removed once the store
+# grows past ATTENDANCE_STORE_MB.
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+from pipeline import StudentTable
+
+class ResultStore:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def run_id(self, run_key):
+        return hashlib.sha256(json.dumps(list(run_key), default=str).encode()).hexdigest()[:24]
+
+    def run_path(self, run_key, file_name=''):
+        return os.path.join(self.directory, self.run_id(run_key), file_name)
+
+    def get(self, run_key):
+        # The StudentTable of a stored run, or None when the run is not stored
+        path = self.run_path(run_key)
+        try:
+            with open(os.path.join(path, 'run.json')) as meta_file:
+                meta = json.load(meta_file)
+            schools = pd.read_parquet(os.path.join(path, 'schools.parquet'), memory_map=True)
+        except FileNotFoundError:  # never stored, or evicted
+            return None
+        self.touch(path)
+        return StudentTable(schools, meta['student_digits'], meta['selected_param'])
+
+    def put(self, run_key, table):
+        # Store a StudentTable under run_key (written to a temporary directory and moved into place) and return it
+        os.makedirs(self.directory, exist_ok=True)
+        partial = tempfile.mkdtemp(dir=self.directory, suffix='.part')
+        try:
+            table.schools.to_parquet(os.path.join(partial, 'schools.parquet'), index=True)
+            with open(os.path.join(partial, 'run.json'), 'w') as meta_file:
+                json.dump({'run_key': list(run_key), 'student_digits': table.student_digits,
+                           'selected_param': table.selected_param, 'created': time.time()}, meta_file, default=str)
+            try:
+                os.replace(partial, self.run_path(run_key).rstrip(os.sep))
+            except OSError:  # another session stored the same run first
+                shutil.rmtree(partial, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        self.evict(keep=self.run_id(run_key))
+        return table
+
+    def get_or_compute(self, run_key, compute):
+        table = self.get(run_key)
+        if table is None:
+            self.put(run_key, compute())
+            # Serve the memory-mapped copy so the computed frames can be freed right away
+            table = self.get(run_key)
+        return table
+
+    def artifact(self, run_key, file_name, compute):
+        # Bytes of a file derived from a stored run (e.g. an export), built by compute() on first use and kept with the run
+        path = self.run_path(run_key, file_name)
+        if not os.path.exists(path):
+            data = compute()
+            if not os.path.isdir(self.run_path(run_key)):
+                return data
+            fd, partial_path = tempfile.mkstemp(dir=self.run_path(run_key), suffix='.part')
+            with os.fdopen(fd, 'wb') as artifact_file:
+                artifact_file.write(data)
+            os.replace(partial_path, path)
+            self.evict(keep=self.run_id(run_key))
+            return data
+        self.touch(self.run_path(run_key))
+        with open(path, 'rb') as artifact_file:
+            return artifact_file.read()
+
+    def touch(self, path):
+        # Mark a run as used now; eviction goes by the modification time of run.json
+        try:
+            os.utime(os.path.join(path, 'run.json'))
+        except FileNotFoundError:
+            pass
+
+    def runs(self):
+        # (run id, bytes on disk, last used) of every stored run
+        runs = []
+        if not os.path.isdir(self.directory):
+            return runs
+        for run_id in os.listdir(self.directory):
+            path = os.path.join(self.directory, run_id)
+            try:
+                last_used = os.path.getmtime(os.path.join(path, 'run.json'))
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+            except FileNotFoundError:  # a run being written or removed
+                continue
+            runs.append((run_id, size, last_used))
+        return runs
+
+    def evict(self, keep=None):
+        # Remove the least recently used runs until the store fits max_bytes; keep (the run just used) always stays
+        with self.lock:
+            runs = sorted(self.runs(), key=lambda run: run[2])
+            total = sum(size for _, size, _ in runs)
+            for run_id, size, _ in runs:
+                if total <= self.max_bytes:
+                    break
+                if run_id == keep:
+                    continue
+                shutil.rmtree(os.path.join(self.directory, run_id), ignore_errors=True)
+                total -= size
+
+    def stats(self):
+        runs = self.runs()
+        return {'runs': len(runs), 'bytes': sum(size for _, size, _ in runs), 'max_bytes': self.max_bytes}
+
+# Process-wide store; its location and quota can be set per deployment through the environment
+result_store = ResultStore(
+    directory=os.environ.get('ATTENDANCE_STORE_DIR', os.path.join(tempfile.gettempdir(), 'attendance_results')),
+    max_bytes=int(os.environ.get('ATTENDANCE_STORE_MB', 2048)) * 1024 * 1024
+)
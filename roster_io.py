@@ -0,0 +1,188 @@
+# Roster ingestion and export.
+# Rosters load from xlsx (fastest available reader), csv or parquet with only the columns the pipeline uses;
+# generated sheets are written as constant-memory xlsx (split across sheets past Excel's row limit), csv or parquet.
+import importlib.util
+import io
+import os
+import time
+
+import pandas as pd
+
+from instrumentation import timed_stage
+
+# Columns the pipeline reads from a roster (Grade is optional); anything else in the file is skipped while loading
+roster_columns = ['District', 'Block', 'School_ID', 'School', 'Total_Students', 'Grade']
+# Text columns are loaded as strings so mixed numeric/text cells do not end up as object columns of mixed types
+roster_text_columns = ['District', 'Block', 'School_ID', 'School', 'Grade']
+
+roster_formats = {
+    '.xlsx': 'xlsx',
+    '.xlsm': 'xlsx',
+    '.csv': 'csv',
+    '.parquet': 'parquet',
+    '.pq': 'parquet'
+}
+
+def roster_format(source):
+    # Format from the file name (uploaded files carry it in .name); anything unknown is treated as xlsx
+    name = getattr(source, 'name', source)
+    extension = os.path.splitext(name)[1].lower() if isinstance(name, str) else ''
+    return roster_formats.get(extension, 'xlsx')
+
+def xlsx_engine():
+    # calamine (Rust, streaming) when installed; pandas' openpyxl reader already opens workbooks read-only
+    return 'calamine' if importlib.util.find_spec('python_calamine') else 'openpyxl'
+
+def wanted_column(column):
+    return column in roster_columns
+
+def read_xlsx(source):
+    engine = xlsx_engine()
+    dtype = {column: str for column in roster_text_columns}
+    try:
+        return pd.read_excel(source, engine=engine, usecols=wanted_column, dtype=dtype), engine
+    except ValueError:
+        if engine == 'openpyxl':
+            raise
+        # Older pandas without the calamine engine
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        return pd.read_excel(source, engine='openpyxl', usecols=wanted_column, dtype=dtype), 'openpyxl'
+
+def read_csv(source):
+    # The pyarrow engine needs an explicit column list, so read the header first
+    header = pd.read_csv(source, nrows=0).columns
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    columns = [column for column in header if column in roster_columns]
+    text_columns = [column for column in roster_text_columns if column in columns]
+    if not importlib.util.find_spec('pyarrow'):
+        return pd.read_csv(source, engine='c', usecols=columns, dtype={column: str for column in text_columns}), 'c'
+    # pyarrow.csv reads the text columns as strings from the start (pandas' pyarrow engine parses them as numbers
+    # and casts afterwards, dropping leading zeros and failing on blank integer cells); blanks become nulls as with
+    # the C parser, and Total_Students is made numeric by load_roster()
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    convert_options = pa_csv.ConvertOptions(include_columns=columns, column_types={column: pa.string() for column in text_columns},
+                                            strings_can_be_null=True)
+    return pa_csv.read_csv(source, convert_options=convert_options).to_pandas(), 'pyarrow'
+
+def read_parquet(source):
+    import pyarrow.parquet as pq
+    columns = [column for column in pq.read_schema(source).names if column in roster_columns]
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    data = pd.read_parquet(source, engine='pyarrow', columns=columns)
+    for column in roster_text_columns:
+        if column in data.columns and not pd.api.types.is_string_dtype(data[column]):
+            data[column] = data[column].astype(str).where(data[column].notna())
+    return data, 'pyarrow'
+
+roster_readers = {
+    'xlsx': read_xlsx,
+    'csv': read_csv,
+    'parquet': read_parquet
+}
+
+def load_roster(source):
+    # Load a roster from an uploaded file object or a local path.
+    # Returns the frame and a report of the format, reader engine, size and load time.
+    if hasattr(source, 'seek'):
+        source.seek(0)  # An uploaded file may already have been read by an earlier run
+    file_format = roster_format(source)
+    started = time.perf_counter()
+    data, engine = roster_readers[file_format](source)
+    if 'Total_Students' in data.columns:
+        data['Total_Students'] = pd.to_numeric(data['Total_Students'], errors='coerce')
+    report = {
+        'format': file_format,
+        'engine': engine,
+        'rows': len(data),
+        'columns': list(data.columns),
+        'seconds': time.perf_counter() - started
+    }
+    return data, report
+
+# Rows per worksheet allowed by Excel, header row included
+excel_max_rows = 1048576
+# Rows converted to Python values at a time while streaming a frame into a workbook
+excel_chunk_rows = 50000
+
+export_formats = {
+    'xlsx': ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': ('.csv', 'text/csv'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet')
+}
+
+def frame_chunks(frames, chunk_rows=excel_chunk_rows):
+    # A frame split into chunk_rows slices, or an iterable of frames (e.g. StudentTable.iter_mapped()) as is
+    if isinstance(frames, pd.DataFrame):
+        return (frames.iloc[start:start + chunk_rows] for start in range(0, max(len(frames), 1), chunk_rows))
+    return iter(frames)
+
+def write_excel(frames, target, sheet_name='Sheet1', max_rows=excel_max_rows):
+    # Write a frame (or an iterable of frames with the same columns) to a path or binary buffer with xlsxwriter's
+    # constant-memory mode, row by row.
+    # Frames longer than one worksheet continue on "<sheet_name> (2)", "<sheet_name> (3)", ... with the header repeated.
+    import xlsxwriter  # Only needed once an xlsx export is requested
+    workbook = xlsxwriter.Workbook(target, {'constant_memory': True})
+    # Same header style as DataFrame.to_excel()
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    rows_per_sheet = max_rows - 1
+    worksheet = None
+    columns = []
+    position = 0
+    for chunk in frame_chunks(frames):
+        columns = list(chunk.columns)
+        values = chunk.astype(object).where(chunk.notna(), None).to_numpy().tolist()
+        for row in values:
+            if position % rows_per_sheet == 0:
+                sheet_number = position // rows_per_sheet + 1
+                worksheet = workbook.add_worksheet(sheet_name if sheet_number == 1 else f'{sheet_name} ({sheet_number})')
+                worksheet.write_row(0, 0, columns, header_format)
+            worksheet.write_row(position % rows_per_sheet + 1, 0, row)
+            position += 1
+    if worksheet is None:
+        # Empty frame: header only
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, columns, header_format)
+    workbook.close()
+
+def write_csv(frames, target):
+    # Write a frame or an iterable of frames as one csv, with the header of the first
+    for index, chunk in enumerate(frame_chunks(frames)):
+        chunk.to_csv(target, index=False, header=index == 0, mode='w' if index == 0 else 'a')
+
+def write_parquet(frames, target):
+    # Write a frame or an iterable of frames as one parquet file, one row group per frame
+    if isinstance(frames, pd.DataFrame):
+        frames.to_parquet(target, index=False)
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    for chunk in frames:
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(target, table.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+@timed_stage('write_export')
+def write_export(frames, target, file_format='xlsx'):
+    # Write a frame, or an iterable of frames streamed one at a time, to a path or binary buffer in one of export_formats
+    if file_format == 'xlsx':
+        write_excel(frames, target)
+    elif file_format == 'csv':
+        write_csv(frames, target)
+    elif file_format == 'parquet':
+        write_parquet(frames, target)
+    else:
+        raise ValueError(f"Unsupported export format: {file_format}")
+
+def export_frame(frames, file_format='xlsx'):
+    # Raw file bytes of a frame (or an iterable of frames) in the requested export format, for a download button
+    buffer = io.BytesIO()
+    write_export(frames, buffer, file_format)
+    return buffer.getvalue()
@@ -0,0 +1,262 @@
+# Sharded generation for rosters too large for one process or machine.
+# plan reads the roster once, assigns the District/Block/School IDs and buffered counts (O(roster rows), exactly as a
+# single run numbers them) and splits the school rows into contiguous ranges, cut only where the District (or Block)
+# changes and balanced by student count. Each shard is pre-allocated its range of school rows and student numbers
+# and gets its own directory in a shared folder; the per-student work (ID text, student sheet, PDFs) then runs per
+# shard in local processes or on any machine that sees the folder. merge checks that the shard ranges tile the
+# roster and stitches the parts back in the single-run order, so the output equals a single-node run.
+#     python sharding.py plan roster.xlsx shared/ --shards 8
+#     python sharding.py run shared/ --shard 3          (on each node, one call per shard)
+#     python sharding.py merge shared/ -o output/
+#     python sharding.py local roster.xlsx shared/ -o output/ --shards 8 --workers 4
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from id_registry import IdRegistry
+from pdf_assets import logo_for_partner
+from pipeline import (IdCapacityError, StudentTable, add_run_arguments, naming_options, package_zip, pdf_tasks, process_data,
+                      render_pdf_bytes, render_tasks, with_student_ids, worker_context)
+from roster_io import excel_chunk_rows, export_formats, write_export
+
+shard_columns = ['District', 'Block']
+
+def shard_path(shared_dir, index, file_name=''):
+    return os.path.join(shared_dir, f'shard-{index:04d}', file_name)
+
+def write_json(path, value):
+    # Write a JSON file atomically, so a node polling the shared folder never reads a partial file
+    fd, partial_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    with os.fdopen(fd, 'w') as json_file:
+        json.dump(value, json_file, default=str)
+    os.replace(partial_path, path)
+
+def read_json(path):
+    with open(path) as json_file:
+        return json.load(json_file)
+
+def shard_bounds(table, shards, column='District'):
+    # [first, last) school row ranges of at most `shards` shards with about the same number of students, cut only
+    # where column changes so a district (or block) listed in one run of rows stays in one shard
+    if column not in shard_columns:
+        raise ValueError(f"Shards can only be split by {' or '.join(shard_columns)}")
+    codes, _ = pd.factorize(table.schools[column], use_na_sentinel=False)
+    cuts = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+    total = table.row_starts[-1]
+    targets = [total * index / shards for index in range(1, shards)]
+    chosen = sorted({int(cuts[min(np.searchsorted(table.row_starts[cuts], target), len(cuts) - 1)]) for target in targets} if len(cuts) else set())
+    edges = [0] + chosen + [len(table.schools)]
+    return [(first, last) for first, last in zip(edges, edges[1:]) if last > first]
+
+def id_range(values):
+    # [smallest, largest] non-zero ID of a shard at one hierarchy level ([0, 0] when it has none)
+    ids = pd.to_numeric(values, errors='coerce')
+    ids = ids[ids > 0]
+    return [int(ids.min()), int(ids.max())] if len(ids) else [0, 0]
+
+def clear_plan(shared_dir):
+    # Remove what an earlier plan_shards() wrote to shared_dir, and nothing else. A non-empty folder without a
+    # plan.json is refused, so a wrong path (the working directory, a mount root) is never emptied.
+    os.makedirs(shared_dir, exist_ok=True)
+    entries = os.listdir(shared_dir)
+    if entries and 'plan.json' not in entries:
+        raise ValueError(f"{shared_dir} is not empty and holds no earlier plan; pass an empty or new folder")
+    for entry in entries:
+        path = os.path.join(shared_dir, entry)
+        if entry.startswith('shard-') and os.path.isdir(path):
+            shutil.rmtree(path)
+        elif entry in ('plan.json', 'school_codes.parquet'):
+            os.remove(path)
+
+def plan_shards(source, shared_dir, shards, shard_by='District', partner_id=1, buffer_percent=0.0, grade=1, district_digits=2,
+                block_digits=2, school_digits=4, student_digits=3, selected_param='A4', naming='School Name + District Name',
+                image_path=None, export_format='xlsx', template=True, registry=None, validate=True):
+    # Assign the IDs of the whole roster, split it into shards and write plan.json plus one input directory per shard.
+    # The PDFs are numbered and named on the whole roster (pdf_tasks()), and each sheet goes to the shard holding
+    # the first school row of its school. Returns the plan.
+    table = process_data(source, partner_id, buffer_percent, grade, district_digits, block_digits, school_digits, student_digits,
+                         selected_param, None, registry, validate)
+    bounds = shard_bounds(table, shards, shard_by)
+    first_rows = np.array([first for first, _ in bounds])
+    tasks = pdf_tasks(table.school_records(), naming_options[naming])
+    shard_tasks = [[] for _ in bounds]
+    task_order = []
+    for arcname, record in tasks:
+        positions = table.record_positions(record)
+        index = int(np.searchsorted(first_rows, min(positions), side='right')) - 1 if positions else 0
+        shard_tasks[index].append((arcname, record, positions))
+        task_order.append([arcname, index])
+
+    clear_plan(shared_dir)
+    # School_Codes has one row per roster row, so it is written whole here rather than per shard
+    write_export(table.teacher_codes(), os.path.join(shared_dir, 'school_codes.parquet'), 'parquet')
+    plan = {
+        'student_digits': student_digits,
+        'selected_param': selected_param,
+        'image_path': image_path or logo_for_partner(partner_id),
+        'export_format': export_format,
+        'template': template,
+        'kpis': table.kpis(),
+        'tasks': task_order,
+        'shards': []
+    }
+    for index, (first, last) in enumerate(bounds):
+        os.makedirs(shard_path(shared_dir, index))
+        # The shard's own school rows plus any rows of another shard that share a sheet with them (a school listed again
+        # further down the roster); Row keeps each row's position in the whole roster
+        positions = [row for _, _, record_rows in shard_tasks[index] for row in record_rows]
+        rows = np.union1d(np.arange(first, last), np.asarray(positions, dtype=np.int64))
+        table.schools.iloc[rows].assign(Row=rows).to_parquet(shard_path(shared_dir, index, 'schools.parquet'), index=True)
+        write_json(shard_path(shared_dir, index, 'sheets.json'), [[arcname, record] for arcname, record, _ in shard_tasks[index]])
+        schools = table.schools.iloc[first:last]
+        plan['shards'].append({
+            'rows': [first, last],
+            'students': [int(table.row_starts[first]), int(table.row_starts[last])],
+            'ids': {column: id_range(schools[column]) for column in ['District_ID', 'Block_ID', 'School_ID']},
+            'sheets': len(shard_tasks[index])
+        })
+    write_json(os.path.join(shared_dir, 'plan.json'), plan)
+    return plan
+
+def run_shard(shared_dir, index, workers=1):
+    # Build the student sheet and PDFs of one shard into its directory; result.json marks it done
+    plan = read_json(os.path.join(shared_dir, 'plan.json'))
+    shard = plan['shards'][index]
+    schools = pd.read_parquet(shard_path(shared_dir, index, 'schools.parquet'))
+    rows = schools.pop('Row').to_numpy()
+    table = StudentTable(schools, plan['student_digits'], plan['selected_param'])
+    first, last = (int(position) for position in np.searchsorted(rows, shard['rows']))
+    write_export(table.iter_mapped(first=first, end=last), shard_path(shared_dir, index, 'student_ids.parquet'), 'parquet')
+    tasks = [(arcname, record) for arcname, record in read_json(shard_path(shared_dir, index, 'sheets.json'))]
+    rendered = render_tasks(tasks, render_pdf_bytes, lambda record: with_student_ids(record, table.student_ids), None, None,
+                            plan['image_path'], workers, None, plan['template'])
+    zip_file, _, failures = package_zip(rendered, shard_path(shared_dir, index, 'sheets.zip'))
+    zip_file.close()
+    result = {'students': int(table.row_starts[last] - table.row_starts[first]), 'failures': failures}
+    write_json(shard_path(shared_dir, index, 'result.json'), result)
+    return result
+
+def parquet_chunks(path):
+    # Frames of a parquet file, one batch at a time
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=excel_chunk_rows):
+        yield batch.to_pandas()
+
+def merge_shards(shared_dir, output_dir):
+    # Stitch finished shards into Student_Ids, School_Codes and attendance_Sheets.zip in output_dir, in the order a
+    # single run writes them. Raises ValueError when a shard has not finished or the shards do not tile the roster.
+    plan = read_json(os.path.join(shared_dir, 'plan.json'))
+    results = []
+    missing = []
+    for index in range(len(plan['shards'])):
+        path = shard_path(shared_dir, index, 'result.json')
+        if os.path.exists(path):
+            results.append(read_json(path))
+        else:
+            missing.append(index)
+    if missing:
+        raise ValueError(f"Shards not finished yet: {', '.join(map(str, missing))}")
+    expected_start = 0
+    for index, (shard, result) in enumerate(zip(plan['shards'], results)):
+        start, end = shard['students']
+        if start != expected_start or result['students'] != end - start:
+            raise ValueError(f"Shard {index} does not hold students {start}..{end - 1}; plan again and rerun the shards")
+        expected_start = end
+
+    os.makedirs(output_dir, exist_ok=True)
+    export_format = plan['export_format']
+    extension = export_formats[export_format][0]
+    outputs = {
+        'student_ids': os.path.join(output_dir, f'Student_Ids{extension}'),
+        'school_codes': os.path.join(output_dir, f'School_Codes{extension}'),
+        'zip': os.path.join(output_dir, 'attendance_Sheets.zip')
+    }
+    shard_indexes = range(len(plan['shards']))
+    write_export((chunk for index in shard_indexes for chunk in parquet_chunks(shard_path(shared_dir, index, 'student_ids.parquet'))),
+                 outputs['student_ids'], export_format)
+    write_export(pd.read_parquet(os.path.join(shared_dir, 'school_codes.parquet')), outputs['school_codes'], export_format)
+    archives = [zipfile.ZipFile(shard_path(shared_dir, index, 'sheets.zip')) for index in shard_indexes]
+    try:
+        names = [set(archive.namelist()) for archive in archives]
+        with zipfile.ZipFile(outputs['zip'], 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for arcname, index in plan['tasks']:
+                if arcname in names[index]:
+                    zip_file.writestr(arcname, archives[index].read(arcname))
+    finally:
+        for archive in archives:
+            archive.close()
+    failures = [tuple(failure) for result in results for failure in result['failures']]
+    return outputs, plan['kpis'], failures
+
+def run_local(source, shared_dir, output_dir, shards, workers=1, shard_by='District', **options):
+    # plan, run every shard in up to `workers` local processes, and merge
+    plan = plan_shards(source, shared_dir, shards, shard_by, **options)
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=worker_context()) as executor:
+        list(executor.map(run_shard, [shared_dir] * len(plan['shards']), range(len(plan['shards']))))
+    return merge_shards(shared_dir, output_dir)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate student IDs and attendance sheets in independent shards.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in [('plan', "Assign the IDs and write the shard inputs to a shared folder"),
+                            ('local', "Plan, run every shard in local processes and merge")]:
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('roster', help="Roster file (.xlsx, .csv or .parquet)")
+        command.add_argument('shared_dir', help="Folder shared by every node running shards")
+        command.add_argument('--shards', type=int, default=os.cpu_count() or 1, help="Number of shards")
+        command.add_argument('--shard-by', default='District', choices=shard_columns, help="Column whose values are never split across shards")
+        add_run_arguments(command)
+        if name == 'local':
+            command.add_argument('-o', '--output-dir', default='output', help="Directory for the merged files")
+            command.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Shards processed at the same time")
+    command = commands.add_parser('run', help="Process one shard of a planned folder")
+    command.add_argument('shared_dir')
+    command.add_argument('--shard', type=int, required=True, help="Shard number (see plan)")
+    command.add_argument('--workers', type=int, default=1, help="Worker processes used to render the shard's PDFs")
+    command = commands.add_parser('merge', help="Merge the finished shards of a planned folder")
+    command.add_argument('shared_dir')
+    command.add_argument('-o', '--output-dir', default='output', help="Directory for the merged files")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'run':
+            result = run_shard(args.shared_dir, args.shard, args.workers)
+            print(f"Shard {args.shard}: {result['students']} students, {len(result['failures'])} failed PDFs")
+            return
+        if args.command in ('plan', 'local'):
+            options = dict(
+                partner_id=args.partner_id, buffer_percent=args.buffer_percent, grade=args.grade, district_digits=args.district_digits,
+                block_digits=args.block_digits, school_digits=args.school_digits, student_digits=args.student_digits,
+                selected_param=args.param, naming=args.naming, image_path=args.image_path, export_format=args.export_format,
+                template=args.template, registry=IdRegistry(args.registry) if args.registry else None, validate=args.validate
+            )
+        if args.command == 'plan':
+            plan = plan_shards(args.roster, args.shared_dir, args.shards, args.shard_by, **options)
+            for index, shard in enumerate(plan['shards']):
+                print(f"Shard {index}: school rows {shard['rows'][0]}-{shard['rows'][1] - 1}, students {shard['students'][0]}-{shard['students'][1] - 1}, "
+                      f"{shard['sheets']} sheets")
+            return
+        if args.command == 'local':
+            outputs, kpis, failures = run_local(args.roster, args.shared_dir, args.output_dir, args.shards, args.workers, args.shard_by, **options)
+        else:
+            outputs, kpis, failures = merge_shards(args.shared_dir, args.output_dir)
+    except IdCapacityError as e:
+        parser.exit(2, f"{e}\nUse --no-validate to generate anyway.\n")
+    except (ValueError, FileNotFoundError) as e:
+        parser.exit(1, f"{e}\n")
+    for name, value in kpis.items():
+        print(f"{name}: {value}")
+    for file_name, error in failures:
+        print(f"Failed to render {file_name}: {error}")
+    for path in outputs.values():
+        print(f"Wrote {path}")
+
+if __name__ == "__main__":
+    main()
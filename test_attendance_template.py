@@ -0,0 +1,51 @@
+# The cached page template (AttendanceSheetTemplate) must write the same bytes as drawing every cell
+import re
+
+import numpy as np
+import pytest
+
+import pipeline
+from benchmark import make_roster, write_blank_png
+
+def without_creation_date(data):
+    return re.sub(rb'/CreationDate \(D:\d+\)', b'', data)
+
+@pytest.fixture(scope='module')
+def sheets(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp('template')
+    roster = make_roster(districts=2, blocks=2, schools=3, students=40, na_fraction=0.2, seed=3)
+    # Page breaks, no students at all, and names that need escaping in PDF strings (rows with an NA District or
+    # Block get no sheet, so these rows keep theirs)
+    roster.loc[:2, ['District', 'Block']] = ['District 1', 'Block 1']
+    roster.loc[0, 'Total_Students'] = 180
+    roster.loc[1, 'Total_Students'] = 0
+    roster.loc[2, 'School'] = 'School (North) \\ Annex'
+    roster_path = tmp_path / 'roster.csv'
+    roster.to_csv(roster_path, index=False)
+    logo_path = str(tmp_path / 'logo.png')
+    write_blank_png(logo_path)
+    table = pipeline.process_data(str(roster_path), 1, 10.0, 1, 2, 2, 6, 3, 'A4', validate=False)
+    records = [pipeline.with_student_ids(record, table.student_ids) for record in table.school_records()]
+    return records, logo_path
+
+def test_template_is_supported(sheets):
+    _, logo_path = sheets
+    assert pipeline.attendance_template(logo_path).supported()
+
+def test_template_matches_drawn_sheets(sheets):
+    records, logo_path = sheets
+    assert max(len(record['student_ids']) for record in records) > 100
+    for record in records:
+        drawn = pipeline.pdf_bytes(pipeline.render_attendance_pdf(record, None, logo_path, template=False))
+        stamped = pipeline.pdf_bytes(pipeline.render_attendance_pdf(record, None, logo_path, template=True))
+        assert without_creation_date(stamped) == without_creation_date(drawn), record['School Name']
+
+def test_template_matches_drawn_sheets_for_random_counts(sheets):
+    records, logo_path = sheets
+    rng = np.random.default_rng(0)
+    record = max(records, key=lambda record: len(record['student_ids']))
+    for count in rng.integers(0, len(record['student_ids']) + 1, 8):
+        sized = dict(record, student_ids=record['student_ids'][:count], student_count=int(count))
+        drawn = pipeline.pdf_bytes(pipeline.render_attendance_pdf(sized, None, logo_path, template=False))
+        stamped = pipeline.pdf_bytes(pipeline.render_attendance_pdf(sized, None, logo_path, template=True))
+        assert without_creation_date(stamped) == without_creation_date(drawn), count
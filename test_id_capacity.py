@@ -0,0 +1,48 @@
+# check_id_capacity() must report a Custom_ID collision exactly when the generated Student_Ids sheet has duplicate
+# Roll_Numbers, on random rosters and settings
+import numpy as np
+import pandas as pd
+import pytest
+
+import pipeline
+
+collision_message = 'share their ID digits'
+
+def random_case(seed):
+    # A small roster with repeated School_IDs, short digit settings (so IDs outgrow them and concatenations become
+    # ambiguous), an optional Grade column and 1..40 students per row, plus the ID settings to run it with
+    rng = np.random.default_rng(seed)
+    rows = int(rng.integers(1, 25))
+    roster = pd.DataFrame({
+        'District': [f'District {value}' for value in rng.integers(1, 4, rows)],
+        'Block': [f'Block {value}' for value in rng.integers(1, 13, rows)],
+        'School_ID': [str(value) for value in rng.integers(1, max(2, rows), rows)],
+        'School': [f'School {index}' for index in range(rows)],
+        'Total_Students': rng.integers(1, 41, rows).astype(float)
+    })
+    if rng.random() < 0.3:
+        roster['Grade'] = [str(value) for value in rng.choice(['1', '2', '1,2', '3'], rows)]
+    settings = {
+        'partner_id': int(rng.integers(1, 12)),
+        'grade': int(rng.integers(1, 12)),
+        'district_digits': int(rng.integers(1, 3)),
+        'block_digits': int(rng.integers(1, 3)),
+        'school_digits': int(rng.integers(1, 3)),
+        'student_digits': int(rng.integers(2, 4)),
+        'selected_param': str(rng.choice(list(pipeline.parameter_mapping)))
+    }
+    return roster, settings
+
+@pytest.mark.parametrize('seed', range(250))
+def test_collision_check_is_exact(tmp_path, seed):
+    roster, settings = random_case(seed)
+    roster_path = tmp_path / 'roster.csv'
+    roster.to_csv(roster_path, index=False)
+    table = pipeline.process_data(str(roster_path), settings['partner_id'], 0.0, settings['grade'], settings['district_digits'],
+                                  settings['block_digits'], settings['school_digits'], settings['student_digits'],
+                                  settings['selected_param'], validate=False)
+    problems = pipeline.check_id_capacity(table.schools, settings['district_digits'], settings['block_digits'],
+                                          settings['school_digits'], settings['student_digits'], settings['selected_param'])
+    reported = any(collision_message in problem for problem in problems)
+    duplicated = table.mapped_frame()['Roll_Number'].duplicated().any()
+    assert reported == duplicated, (settings, problems)
@@ -0,0 +1,25 @@
+# Regression checks for roster loading; run with `python -m pytest -q`
+import io
+
+import pandas as pd
+
+from roster_io import load_roster
+
+def csv_upload(text):
+    upload = io.BytesIO(text.encode())
+    upload.name = 'roster.csv'
+    return upload
+
+def test_csv_blank_total_students():
+    # A blank cell in an otherwise integer column used to fail the pyarrow engine's cast
+    data, report = load_roster(csv_upload("District,Block,School_ID,School,Total_Students\nD1,B1,0012,S1,5\nD1,B1,0013,S2,\n"))
+    assert report['rows'] == 2
+    assert data['Total_Students'].iloc[0] == 5
+    assert pd.isna(data['Total_Students'].iloc[1])
+    # Text columns keep their leading zeros
+    assert list(data['School_ID']) == ['0012', '0013']
+
+def test_csv_full_total_students():
+    data, _ = load_roster(csv_upload("District,Block,School_ID,School,Total_Students\nD1,B1,0012,S1,5\n"))
+    assert list(data['School_ID']) == ['0012']
+    assert data['Total_Students'].iloc[0] == 5
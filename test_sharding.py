@@ -0,0 +1,77 @@
+# Sharded generation (plan, run every shard, merge) must write exactly what a single run_pipeline() writes
+import filecmp
+import re
+import zipfile
+
+import pandas as pd
+import pytest
+
+import pipeline
+import sharding
+from benchmark import make_roster, write_blank_png
+
+def without_creation_date(data):
+    return re.sub(rb'/CreationDate \(D:\d+\)', b'', data)
+
+def assert_same_outputs(single, sharded):
+    for name in ('student_ids', 'school_codes'):
+        assert filecmp.cmp(single[name], sharded[name], shallow=False), name
+    with zipfile.ZipFile(single['zip']) as single_zip, zipfile.ZipFile(sharded['zip']) as sharded_zip:
+        assert single_zip.namelist() == sharded_zip.namelist()
+        for name in single_zip.namelist():
+            assert without_creation_date(single_zip.read(name)) == without_creation_date(sharded_zip.read(name)), name
+
+@pytest.fixture
+def logo_path(tmp_path):
+    path = str(tmp_path / 'logo.png')
+    write_blank_png(path)
+    return path
+
+def roster_file(tmp_path, grades=False):
+    roster = make_roster(districts=4, blocks=2, schools=4, students=30, na_fraction=0.1, seed=7)
+    # A school listed again further down the roster shares one sheet across shards
+    roster = pd.concat([roster, roster.iloc[[1]].assign(Total_Students=5.0)], ignore_index=True)
+    if grades:
+        roster['Grade'] = ['1,2' if index % 3 == 0 else '2' for index in range(len(roster))]
+    path = tmp_path / 'roster.csv'
+    roster.to_csv(path, index=False)
+    return str(path)
+
+@pytest.mark.parametrize('grades, shard_by, shards', [(False, 'District', 3), (True, 'Block', 5), (False, 'District', 1)])
+def test_sharded_run_matches_single_run(tmp_path, logo_path, grades, shard_by, shards):
+    roster = roster_file(tmp_path, grades)
+    options = dict(image_path=logo_path, export_format='csv', validate=False)
+    single, single_kpis, single_failures = pipeline.run_pipeline(roster, str(tmp_path / 'single'), **options)
+    plan = sharding.plan_shards(roster, str(tmp_path / 'shared'), shards, shard_by, **options)
+    assert 1 <= len(plan['shards']) <= shards
+    for index in range(len(plan['shards'])):
+        sharding.run_shard(str(tmp_path / 'shared'), index)
+    sharded, sharded_kpis, sharded_failures = sharding.merge_shards(str(tmp_path / 'shared'), str(tmp_path / 'sharded'))
+    assert sharded_kpis == single_kpis
+    assert sharded_failures == single_failures == []
+    assert_same_outputs(single, sharded)
+
+def test_local_run_matches_single_run(tmp_path, logo_path):
+    roster = roster_file(tmp_path)
+    options = dict(image_path=logo_path, export_format='xlsx', validate=False)
+    single, _, _ = pipeline.run_pipeline(roster, str(tmp_path / 'single'), **options)
+    sharded, _, _ = sharding.run_local(roster, str(tmp_path / 'shared'), str(tmp_path / 'sharded'), 2, workers=2, **options)
+    # xlsx files carry their creation time, so compare the sheets
+    for name in ('student_ids', 'school_codes'):
+        assert pd.read_excel(single[name], dtype=str).equals(pd.read_excel(sharded[name], dtype=str)), name
+    with zipfile.ZipFile(single['zip']) as single_zip, zipfile.ZipFile(sharded['zip']) as sharded_zip:
+        assert single_zip.namelist() == sharded_zip.namelist()
+
+def test_merge_refuses_unfinished_shards(tmp_path, logo_path):
+    roster = roster_file(tmp_path)
+    sharding.plan_shards(roster, str(tmp_path / 'shared'), 2, image_path=logo_path, validate=False)
+    with pytest.raises(ValueError, match='not finished'):
+        sharding.merge_shards(str(tmp_path / 'shared'), str(tmp_path / 'sharded'))
+
+def test_plan_refuses_a_folder_it_did_not_create(tmp_path, logo_path):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    (shared / 'keep.txt').write_text('not a plan')
+    with pytest.raises(ValueError, match='not empty'):
+        sharding.plan_shards(roster_file(tmp_path), str(shared), 2, image_path=logo_path, validate=False)
+    assert (shared / 'keep.txt').exists()
@@ -0,0 +1,9 @@
+# Cold-start regression check for the Streamlit app (see startup_report.py)
+from startup_report import default_budget_ms, measure_startup
+
+def test_app_cold_start():
+    # Median of three cold imports, so one slow start on a busy machine does not fail the suite
+    reports = sorted((measure_startup() for _ in range(3)), key=lambda report: report['import_ms'])
+    report = reports[1]
+    assert report['deferred_loaded'] == []
+    assert report['import_ms'] < default_budget_ms, report['slowest'][:5]